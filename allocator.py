@@ -0,0 +1,357 @@
+"""
+Short Code Allocator Module
+
+This module allocates short URLs without checking the database for collisions.
+Each short URL comes from a shared counter in the sequences table: processes reserve blocks of counter values
+with a single atomic UPDATE, then hand them out from memory. Every counter value is encoded as a distinct base36
+short URL, scrambled by a bijective affine map so consecutive values don't produce consecutive short URLs.
+
+The first 36^4 values encode to 4-character short URLs, the next 36^5 to 5-character ones, and so on.
+
+With SHORT_CODE_ALLOCATOR=pool, each process instead keeps a pool of short URLs encoded ahead of time,
+topped up in bulk by a background thread whenever it runs low, so allocating one never touches the database.
+Reserved counter values are committed before they are pooled, so a crash only skips the unused ones
+and never hands out a short URL twice.
+
+Classes:
+    - CodeAllocator: Hands out short URLs from blocks of reserved counter values.
+    - CodePool: Hands out pre-generated short URLs, refilled in the background.
+
+Author: Yousef Saeed
+"""
+
+from collections import deque
+from os import getpid, register_at_fork
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert
+from string import ascii_lowercase, digits
+from threading import Event, Lock, Thread
+from time import perf_counter
+
+from database import *
+
+
+ALPHABET = ascii_lowercase + digits
+MIN_LENGTH = 4
+
+# Any multiplier coprime to 36 makes the scramble a bijection within every code length.
+# The increment is scaled by the length, so longer short URLs don't repeat the digits of shorter ones.
+MULTIPLIER = 0x9E3779B97F4A7C15
+INCREMENT = 0x5DEECE66D
+
+
+def encode(number):
+    """
+    Encode a counter value as a short URL.
+
+    Distinct counter values always encode to distinct short URLs.
+
+    Args:
+        number (int): The counter value, starting at 0.
+
+    Returns:
+        str: The short URL.
+    """
+
+    length = MIN_LENGTH
+    space = len(ALPHABET) ** length
+    while number >= space:
+        number -= space
+        length += 1
+        space = len(ALPHABET) ** length
+
+    number = (number * MULTIPLIER + INCREMENT * length) % space
+
+    chars = []
+    for _ in range(length):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+class CodeAllocator:
+    """
+    CodeAllocator is a class for allocating unique short URLs from a counter shared by every process.
+
+    Attributes:
+        name (str): The name of the counter in the sequences table.
+        block_size (int): The number of counter values reserved at a time.
+
+    Methods:
+        - reserve(count)
+        - next_number()
+        - allocate()
+        - allocate_many(count)
+    """
+
+    def __init__(self, name="short_url", block_size=100):
+        """
+        Initialize CodeAllocator with its counter and block size.
+
+        Args:
+            name (str, optional): The name of the counter in the sequences table.
+            block_size (int, optional): The number of counter values reserved at a time.
+        """
+
+        self.name = name
+        self.block_size = block_size
+
+        self._next = 0
+        self._end = 0
+        self._pid = None
+        self._lock = Lock()
+
+    def reserve(self, count):
+        """
+        Reserve consecutive counter values that no other process will be given.
+
+        The reservation is committed right away on its own connection, independently of the caller's transaction.
+
+        Args:
+            count (int): The number of values to reserve.
+
+        Returns:
+            range: The reserved counter values.
+        """
+
+        table = Sequence.__table__
+        with db.engine.begin() as connection:
+            connection.execute(
+                insert(table).values(name=self.name, value=0).on_conflict_do_nothing()
+            )
+            end = connection.execute(
+                update(table)
+                .where(table.c.name == self.name)
+                .values(value=table.c.value + count)
+                .returning(table.c.value)
+            ).scalar_one()
+        return range(end - count, end)
+
+    def next_number(self):
+        """
+        Get the next unused counter value, reserving a new block when the current one runs out.
+
+        Returns:
+            int: The counter value.
+        """
+
+        with self._lock:
+            # A block reserved before a fork is shared with the parent, so a forked worker reserves its own.
+            if self._next >= self._end or self._pid != getpid():
+                block = self.reserve(self.block_size)
+                self._next, self._end = block.start, block.stop
+                self._pid = getpid()
+
+            number = self._next
+            self._next += 1
+            return number
+
+    def allocate(self):
+        """
+        Allocate a new short URL.
+
+        Must be called inside an application context.
+
+        Returns:
+            str: The short URL.
+        """
+
+        return encode(self.next_number())
+
+    def allocate_many(self, count):
+        """
+        Allocate several new short URLs with a single reservation.
+
+        Must be called inside an application context.
+
+        Args:
+            count (int): The number of short URLs to allocate.
+
+        Returns:
+            list: The short URLs.
+        """
+
+        return [encode(number) for number in self.reserve(count)]
+
+
+class CodePool:
+    """
+    CodePool is a class for handing out pre-generated short URLs from memory.
+
+    Attributes:
+        allocator (CodeAllocator): Reserves the counter values the short URLs are encoded from.
+        size (int): The number of short URLs the pool is topped up to.
+        low_water (int): The pool depth below which the background thread refills it.
+
+    Methods:
+        - refill()
+        - allocate()
+        - allocate_many(count)
+        - stats()
+    """
+
+    def __init__(self, allocator, size=1000, low_water=250):
+        """
+        Initialize CodePool with its allocator and refill thresholds.
+
+        Args:
+            allocator (CodeAllocator): Reserves the counter values the short URLs are encoded from.
+            size (int, optional): The number of short URLs the pool is topped up to.
+            low_water (int, optional): The pool depth below which the background thread refills it.
+        """
+
+        self.allocator = allocator
+        self.size = size
+        self.low_water = low_water
+
+        self.refills = 0
+        self.failed_refills = 0
+        self.empty_takes = 0
+        self.codes_reserved = 0
+        self.last_refill_latency = 0.0
+        self.max_refill_latency = 0.0
+        self.total_refill_latency = 0.0
+
+        self._reset()
+        # Short URLs pooled before a fork are shared with the parent, so a forked worker starts from an empty pool.
+        register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        """
+        Empty the pool and forget the refill thread.
+        """
+
+        self._codes = deque()
+        self._lock = Lock()
+        self._low = Event()
+        self._thread = None
+
+    def refill(self):
+        """
+        Top the pool up to its full size with a single reservation.
+
+        Must be called inside an application context.
+
+        Returns:
+            int: The number of short URLs added.
+        """
+
+        with self._lock:
+            missing = self.size - len(self._codes)
+            if missing <= 0:
+                return 0
+
+            start_time = perf_counter()
+            numbers = self.allocator.reserve(missing)
+            self._codes.extend(encode(number) for number in numbers)
+            latency = perf_counter() - start_time
+
+            self.refills += 1
+            self.codes_reserved += missing
+            self.last_refill_latency = latency
+            self.max_refill_latency = max(self.max_refill_latency, latency)
+            self.total_refill_latency += latency
+
+        return missing
+
+    def allocate(self):
+        """
+        Take a short URL from the pool, waking the refill thread if the pool is running low.
+
+        Only refills in the caller's thread when the pool is empty, which needs an application context.
+
+        Returns:
+            str: The short URL.
+        """
+
+        if self._thread is None:
+            self._start()
+
+        while True:
+            try:
+                code = self._codes.popleft()
+                break
+            except IndexError:
+                self.empty_takes += 1
+                self.refill()
+
+        if len(self._codes) < self.low_water:
+            self._low.set()
+        return code
+
+    def allocate_many(self, count):
+        """
+        Allocate several new short URLs with a single reservation, leaving the pool for single allocations.
+
+        Must be called inside an application context.
+
+        Args:
+            count (int): The number of short URLs to allocate.
+
+        Returns:
+            list: The short URLs.
+        """
+
+        return self.allocator.allocate_many(count)
+
+    def stats(self):
+        """
+        Get metrics describing the pool's depth and refills.
+
+        Returns:
+            dict: The pool depth, refill counts, reserved short URLs, and refill latencies in seconds.
+        """
+
+        return {
+            "depth": len(self._codes),
+            "size": self.size,
+            "low_water": self.low_water,
+            "refills": self.refills,
+            "failed_refills": self.failed_refills,
+            "empty_takes": self.empty_takes,
+            "codes_reserved": self.codes_reserved,
+            "last_refill_latency": self.last_refill_latency,
+            "max_refill_latency": self.max_refill_latency,
+            "average_refill_latency": (
+                self.total_refill_latency / self.refills if self.refills else 0
+            ),
+        }
+
+    def _start(self):
+        """
+        Start the refill thread, if it is not already running.
+        """
+
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = Thread(target=self._run, name="code-pool", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """
+        Refill the pool whenever it drops below the low-water mark.
+        """
+
+        while True:
+            self._low.wait()
+            self._low.clear()
+            with app.app_context():
+                try:
+                    self.refill()
+                except Exception:
+                    self.failed_refills += 1
+
+
+counter = CodeAllocator(block_size=app.config["SHORT_CODE_BLOCK_SIZE"])
+
+# Shortener allocates short URLs from whichever allocator is configured; both provide allocate() and allocate_many().
+allocator = (
+    CodePool(
+        counter,
+        size=app.config["SHORT_CODE_POOL_SIZE"],
+        low_water=app.config["SHORT_CODE_POOL_LOW_WATER"],
+    )
+    if app.config["SHORT_CODE_ALLOCATOR"] == "pool"
+    else counter
+)
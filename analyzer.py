@@ -4,22 +4,125 @@ URL Analyzer Module
 This module provides analytics functionality for tracking user interactions with short URLs.
 It collects information about user agents, response times, IP addresses, and geolocation data.
 It can generate statistics such as entry times, platform usage, browser usage, and location information for a given short URL.
+Counts, averages, top values, and entry times are read from per-URL click counters and hourly click counts
+that are kept up to date as clicks are written.
+
+Clicks can be stored while the request is being handled, or queued and stored by background workers,
+depending on the TRACKING_MODE setting.
+
+User agents are parsed per click, with the results memoized by the raw User-Agent string.
+
+Functions:
+    - parse_user_agent(user_agent): Parse a user agent into its platform and browser.
 
 Classes:
+    - ClickEvent: The request-bound details of a single click, captured before enrichment.
     - Analyzer: The main class for tracking and analyzing user interactions with short URLs.
 
 Author: Yousef Saeed
 """
 
 from flask import request
-from sqlalchemy import func, Float
+from sqlalchemy import select
 from ua_parser import user_agent_parser
-from ip2geotools.databases.noncommercial import DbIpCity
 from geopy.distance import distance
-from statistics import multimode
-import datetime
+from collections import namedtuple, Counter
+from time import time, localtime
 
 from database import *
+from tracker import Tracker
+from writer import writer
+from rollups import load as load_rollups
+from geolocation import locator
+from cache import LRUCache
+
+
+ClickEvent = namedtuple(
+    "ClickEvent",
+    ["short_url", "entry_time", "user_agent", "ip", "server_ip", "response_time"],
+)
+
+# A small number of user agents account for most clicks, so parsed results are memoized.
+user_agents = LRUCache(app.config["UA_CACHE_SIZE"])
+
+
+def parse_user_agent(user_agent):
+    """
+    Parse a user agent string into its platform and browser, memoizing the result.
+
+    Args:
+        user_agent (str): The raw User-Agent header.
+
+    Returns:
+        tuple: The platform (OS) and the browser with its version.
+    """
+
+    parsed = user_agents.get(user_agent)
+    if parsed is None:
+        user_details = user_agent_parser.Parse(user_agent or "")
+        browser = user_details["user_agent"]["family"]
+        browser_version = ".".join(
+            [
+                user_details["user_agent"][key]
+                for key in ("major", "minor", "patch")
+                if user_details["user_agent"][key] is not None
+            ]
+        )
+        parsed = (user_details["os"]["family"], f"{browser}-{browser_version}")
+        user_agents.set(user_agent, parsed)
+    return parsed
+
+
+def _average(rollup):
+    """
+    Average a summed column from its (entries, total) counter, or return None without entries like SQL's AVG.
+    """
+
+    entries, total = rollup
+    return total / entries if entries else None
+
+
+def _modes(counter):
+    """
+    Get the most common keys of a Counter, in order of first appearance like statistics.multimode.
+    """
+
+    if not counter:
+        return []
+    highest = max(counter.values())
+    return [key for key, count in counter.items() if count == highest]
+
+
+def _time_modes(buckets):
+    """
+    Get the most common hours of the day, days of the month, and months of the year from hourly click counts.
+    """
+
+    hours, days, months = Counter(), Counter(), Counter()
+    for bucket, entries in buckets.items():
+        start = localtime(bucket)
+        hours[f"{start.tm_hour:02}"] += entries
+        days[f"{start.tm_mday:02}"] += entries
+        months[f"{start.tm_mon:02}"] += entries
+    return _modes(hours), _modes(days), _modes(months)
+
+
+def _top(counter, name, limit):
+    """
+    Get the most common values of a Counter as a list of {name: value, "count": count} dicts.
+
+    Ties are broken by value, with NULL first, so the result is deterministic.
+    Like COUNT(column), a NULL value forms a group but isn't counted.
+    """
+
+    if None in counter:
+        counter = counter.copy()
+        counter[None] = 0
+    ranked = sorted(
+        counter.items(),
+        key=lambda item: (-item[1], item[0] is not None, item[0] or ""),
+    )
+    return [{name: value, "count": count} for value, count in ranked[:limit]]
 
 
 class Analyzer:
@@ -29,70 +132,76 @@ class Analyzer:
     Attributes:
         - short_url (str): The short URL being analyzed.
         - user_agent (str): The user agent string from the client's browser.
-        - response_time (str): The response time of the server.
+        - response_time (float): The response time of the server.
 
     Methods:
         - get_entry_time()
-        - get_platform()
-        - get_browser()
+        - get_platform(user_agent=None)
+        - get_browser(user_agent=None)
         - get_ip()
         - get_location()
         - get_distance()
-        - track()
+        - capture(short_url, user_agent, response_time=None)
+        - build_row(event)
+        - persist(events)
+        - track(short_url, user_agent, response_time=None)
         - total_entries()
         - total_unique_entries()
         - most_frequent_times()
         - analyze(short_url=None)
-        - delete()
+        - analyze_many(short_urls)
+        - export(short_url=None, since=None, until=None, chunk_size=1000)
+        - delete(short_urls=None)
     """
 
     def __init__(self):
         """
-        Initialize Analyzer with default attributes and parse user agent details.
+        Initialize Analyzer with default attributes.
         """
 
         self.short_url = ""
         self.user_agent = ""
-        self.response_time = ""
-        self.user_details = user_agent_parser.Parse(self.user_agent)
+        self.response_time = None
 
     def get_entry_time(self):
         """
-        Get the current entry time in the format "%d-%m-%Y.%H:%M:%S".
+        Get the current entry time in seconds since the epoch.
 
         Returns:
-            str: The current entry time.
+            int: The current entry time.
         """
 
-        return datetime.datetime.now().strftime("%d-%m-%Y.%H:%M:%S")
+        return int(time())
 
-    def get_platform(self):
+    def get_platform(self, user_agent=None):
         """
         Get the platform (OS) of the client from the user agent.
 
+        Args:
+            user_agent (str, optional): The user agent to parse. If not provided, uses the stored user agent.
+
         Returns:
             str: The platform (OS) of the client.
         """
 
-        return self.user_details["os"]["family"]
+        if user_agent is None:
+            user_agent = self.user_agent
+        return parse_user_agent(user_agent)[0]
 
-    def get_browser(self):
+    def get_browser(self, user_agent=None):
         """
         Get the browser and version from the user agent.
 
+        Args:
+            user_agent (str, optional): The user agent to parse. If not provided, uses the stored user agent.
+
         Returns:
             str: The browser and its version.
         """
 
-        browser = self.user_details["user_agent"]["family"]
-        browser_version = ".".join(
-            [
-                self.user_details["user_agent"][key]
-                for key in ("major", "minor", "patch")
-                if self.user_details["user_agent"][key] is not None
-            ]
-        )
-        return f"{browser}-{browser_version}"
+        if user_agent is None:
+            user_agent = self.user_agent
+        return parse_user_agent(user_agent)[1]
 
     def get_ip(self):
         """
@@ -105,67 +214,140 @@ class Analyzer:
         client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
         return client_ip
 
-    def get_location(self):
+    def get_location(self, client_ip=None):
         """
         Get geolocation details (city, region, country, latitude, longitude) of the client based on their IP address.
 
+        Args:
+            client_ip (str, optional): The IP address to locate. If not provided, uses the current request's client IP.
+
         Returns:
             dict: Geolocation details of the client.
         """
 
-        client_ip = self.get_ip()
-        client_details = DbIpCity.get(client_ip)
-        return {
-            "city": client_details.city,
-            "region": client_details.region,
-            "country": client_details.country,
-            "latitude": client_details.latitude,
-            "longitude": client_details.longitude,
-        }
+        if client_ip is None:
+            client_ip = self.get_ip()
+        return locator.locate(client_ip)
 
-    def get_distance(self):
+    def get_distance(self, client_ip=None, server_ip=None):
         """
         Calculate the distance in kilometers between the client and the server based on their IP addresses' geolocation.
 
+        Args:
+            client_ip (str, optional): The client's IP address. If not provided, uses the current request's client IP.
+            server_ip (str, optional): The server's IP address. Ignored if the server's location was resolved at startup.
+                If not provided, uses the current request's remote address.
+
         Returns:
-            float: The distance between the client and the server.
+            float: The distance between the client and the server, or None if either location is unknown.
         """
 
-        client_ip = self.get_ip()
-        server_ip = request.remote_addr
-        client_details = DbIpCity.get(client_ip)
-        server_details = DbIpCity.get(server_ip)
+        if client_ip is None:
+            client_ip = self.get_ip()
+        client_details = locator.locate(client_ip)
+        server_details = locator.server_location
+        if server_details is None:
+            if server_ip is None:
+                server_ip = request.remote_addr
+            server_details = locator.locate(server_ip)
+        if client_details["latitude"] is None or server_details["latitude"] is None:
+            return None
         return distance(
-            (client_details.latitude, client_details.longitude),
-            (server_details.latitude, server_details.longitude),
+            (client_details["latitude"], client_details["longitude"]),
+            (server_details["latitude"], server_details["longitude"]),
         ).km
 
-    def track(self):
+    def capture(self, short_url, user_agent, response_time=None):
         """
-        Track user interactions and store the details in the database as a Stat record.
+        Capture the details of the current click that are only available while handling the request.
+
+        The click's own details are passed in rather than read from the analyzer's attributes,
+        since one analyzer is shared by every request thread.
+
+        Args:
+            short_url (str): The clicked short URL.
+            user_agent (str): The user agent string from the client's browser.
+            response_time (float, optional): The seconds the redirect took to handle so far.
 
         Returns:
-            None
+            ClickEvent: The captured click, ready to be enriched and stored later.
         """
 
-        client_location = self.get_location()
-
-        new_stat = Stat(
-            short_url=self.short_url,
+        return ClickEvent(
+            short_url=short_url,
             entry_time=self.get_entry_time(),
-            response_time=self.response_time,
-            platform=self.get_platform(),
-            browser=self.get_browser(),
+            user_agent=user_agent,
             ip=self.get_ip(),
+            server_ip=request.remote_addr,
+            response_time=response_time,
+        )
+
+    def build_row(self, event):
+        """
+        Enrich a captured click with platform, browser, and geolocation details.
+
+        Args:
+            event (ClickEvent): The captured click.
+
+        Returns:
+            dict: The Stat column values for the click.
+        """
+
+        client_location = self.get_location(event.ip)
+        client_distance = self.get_distance(event.ip, event.server_ip)
+
+        return dict(
+            short_url=event.short_url,
+            entry_time=event.entry_time,
+            response_time=event.response_time,
+            platform=self.get_platform(event.user_agent),
+            browser=self.get_browser(event.user_agent),
+            ip=event.ip,
             city=client_location["city"],
             region=client_location["region"],
             country=client_location["country"],
             latitude=client_location["latitude"],
             longitude=client_location["longitude"],
-            distance=f"{self.get_distance():.10f}",
+            distance=client_distance,
         )
-        db.session.add(new_stat)
-        db.session.commit()
+
+    def persist(self, events):
+        """
+        Enrich captured clicks and hand them to the batched Stat writer.
+
+        The rows are written once the writer's batch is full or its flush interval has passed.
+
+        Args:
+            events (list): The ClickEvent objects to store.
+
+        Returns:
+            None
+        """
+
+        writer.add_many([self.build_row(event) for event in events])
+        writer.flush_if_due()
+
+    def track(self, short_url, user_agent, response_time=None):
+        """
+        Track user interactions and store the details in the database as a Stat record.
+
+        In "async" tracking mode the click is only queued here and stored later by the tracker's workers.
+
+        Args:
+            short_url (str): The clicked short URL.
+            user_agent (str): The user agent string from the client's browser.
+            response_time (float, optional): The seconds the redirect took to handle so far.
+
+        Returns:
+            None
+        """
+
+        event = self.capture(short_url, user_agent, response_time)
+        if app.config["TRACKING_MODE"] == "async":
+            tracker.submit(event)
+        else:
+            self.persist([event])
+            writer.flush()
 
     def total_entries(self):
         """
@@ -175,8 +357,7 @@ class Analyzer:
             int: The total number of entries.
         """
 
-        urls = db.session.query(Stat).where(Stat.short_url == self.short_url)
-        return urls.count()
+        return load_rollups([self.short_url])[self.short_url]["clicks"]
 
     def total_unique_entries(self):
         """
@@ -186,44 +367,27 @@ class Analyzer:
             int: The total number of unique entries.
         """
 
-        urls = (
-            db.session.query(Stat)
-            .where(Stat.short_url == self.short_url)
-            .group_by(Stat.ip)
-        )
-        return urls.count()
+        return load_rollups([self.short_url])[self.short_url]["unique"]
 
     def most_frequent_times(self):
         """
         Determine the most frequent entry times of the day, month, and year for the current short URL.
 
+        They are tallied from the URL's hourly click counts, so the cost doesn't grow with the number of clicks.
+
         Returns:
             tuple: A tuple containing the most frequent entry times of the day, month, and year.
         """
 
-        urls = db.session.query(Stat).where(Stat.short_url == self.short_url)
-        hours_list = []
-        days_list = []
-        months_list = []
-        for url in urls:
-            time = datetime.datetime.strptime(
-                url.entry_time, "%d-%m-%Y.%H:%M:%S"
-            ).strftime("%H")
-            day = datetime.datetime.strptime(
-                url.entry_time, "%d-%m-%Y.%H:%M:%S"
-            ).strftime("%d")
-            month = datetime.datetime.strptime(
-                url.entry_time, "%d-%m-%Y.%H:%M:%S"
-            ).strftime("%m")
-            hours_list.append(time)
-            days_list.append(day)
-            months_list.append(month)
-        return multimode(hours_list), multimode(days_list), multimode(months_list)
+        return _time_modes(load_rollups([self.short_url])[self.short_url]["buckets"])
 
     def analyze(self, short_url=None):
         """
         Analyze user interactions and generate statistics for a given short URL.
 
+        Every statistic comes from the URL's click counters and hourly click counts, in time proportional to its
+        distinct values and active hours rather than its clicks.
+
         Args:
             short_url (str, optional): The short URL to analyze. If not provided, uses the stored short URL.
 
@@ -231,120 +395,146 @@ class Analyzer:
             dict: A dictionary containing various statistics and details of user interactions.
         """
 
-        if short_url is not None:
-            self.short_url = short_url
+        if short_url is None:
+            short_url = self.short_url
 
-        entries = (
-            db.session.query(Stat.entry_time)
-            .where(Stat.short_url == self.short_url)
-            .all()
-        )
-        entries = [{"entry": entry[0]} for entry in entries]
+        return self.analyze_many([short_url])[short_url]
 
-        total_entries_count = self.total_entries()
-        total_unique_entries_count = self.total_unique_entries()
+    def analyze_many(self, short_urls):
+        """
+        Analyze user interactions for several short URLs at once.
 
-        times = self.most_frequent_times()
-        most_frequent_entry_time_of_day = times[0]
-        most_frequent_entry_time_of_month = times[1]
-        most_frequent_entry_time_of_year = times[2]
+        Counters are read for a whole chunk of URLs per query, so the number of queries doesn't grow with the number of URLs.
 
-        average_response_time = (
-            db.session.query(func.avg(func.cast(Stat.response_time, Float)))
-            .where(Stat.short_url == self.short_url)
-            .scalar()
-        )
+        Args:
+            short_urls (list): The short URLs to analyze.
 
-        top_platforms = (
-            db.session.query(Stat.platform, func.count(Stat.platform))
-            .where(Stat.short_url == self.short_url)
-            .group_by(Stat.platform)
-            .order_by(func.count(Stat.platform).desc())
-            .limit(3)
-            .all()
-        )
-        top_platforms = [
-            {"platform": platform[0], "count": platform[1]}
-            for platform in top_platforms
-        ]
-
-        top_browsers = (
-            db.session.query(Stat.browser, func.count(Stat.browser))
-            .where(Stat.short_url == self.short_url)
-            .group_by(Stat.browser)
-            .order_by(func.count(Stat.browser).desc())
-            .limit(3)
-            .all()
-        )
-        top_browsers = [
-            {"browser": browser[0], "count": browser[1]} for browser in top_browsers
-        ]
-
-        top_countries = (
-            db.session.query(Stat.country, func.count(Stat.country))
-            .where(Stat.short_url == self.short_url)
-            .group_by(Stat.country)
-            .order_by(func.count(Stat.country).desc())
-            .limit(10)
-            .all()
-        )
-        top_countries = [
-            {"country": country[0], "count": country[1]} for country in top_countries
-        ]
-
-        top_regions = (
-            db.session.query(Stat.region, func.count(Stat.region))
-            .where(Stat.short_url == self.short_url)
-            .group_by(Stat.region)
-            .order_by(func.count(Stat.region).desc())
-            .limit(10)
-            .all()
-        )
-        top_regions = [
-            {"region": region[0], "count": region[1]} for region in top_regions
-        ]
-
-        top_cities = (
-            db.session.query(Stat.city, func.count(Stat.city))
-            .where(Stat.short_url == self.short_url)
-            .group_by(Stat.city)
-            .order_by(func.count(Stat.city).desc())
-            .limit(10)
-            .all()
-        )
-        top_cities = [{"city": city[0], "count": city[1]} for city in top_cities]
+        Returns:
+            dict: The statistics of each short URL, in the same format as analyze(), keyed by short URL.
+        """
 
-        average_distance = (
-            db.session.query(func.avg(func.cast(Stat.distance, Float)))
-            .where(Stat.short_url == self.short_url)
-            .scalar()
-        )
+        results = {}
+        for short_url, rollup in load_rollups(short_urls).items():
+            hours, days, months = _time_modes(rollup["buckets"])
+            results[short_url] = {
+                "total_entries_count": rollup["clicks"],
+                "total_unique_entries_count": rollup["unique"],
+                "most_frequent_entry_time_of_day": hours,
+                "most_frequent_entry_time_of_month": days,
+                "most_frequent_entry_time_of_year": months,
+                "average_response_time": _average(rollup["response_time"]),
+                "top_platforms": _top(rollup["platform"], "platform", 3),
+                "top_browsers": _top(rollup["browser"], "browser", 3),
+                "top_countries": _top(rollup["country"], "country", 10),
+                "top_regions": _top(rollup["region"], "region", 10),
+                "top_cities": _top(rollup["city"], "city", 10),
+                "average_distance": _average(rollup["distance"]),
+            }
+
+        return results
+
+    def export(self, short_url=None, since=None, until=None, chunk_size=1000):
+        """
+        Iterate over the raw Stat rows of a short URL, oldest first, optionally within a time range.
+
+        Rows are fetched in chunks of chunk_size by seeking the short_url index past the last row returned,
+        so each chunk is a short query and no transaction stays open while the rows are consumed.
 
-        return {
-            "entries": entries,
-            "total_entries_count": total_entries_count,
-            "total_unique_entries_count": total_unique_entries_count,
-            "most_frequent_entry_time_of_day": most_frequent_entry_time_of_day,
-            "most_frequent_entry_time_of_month": most_frequent_entry_time_of_month,
-            "most_frequent_entry_time_of_year": most_frequent_entry_time_of_year,
-            "average_response_time": average_response_time,
-            "top_platforms": top_platforms,
-            "top_browsers": top_browsers,
-            "top_countries": top_countries,
-            "top_regions": top_regions,
-            "top_cities": top_cities,
-            "average_distance": average_distance,
-        }
-
-    def delete(self):
-        """
-        Delete all records associated with the current short URL from the database.
+        Args:
+            short_url (str, optional): The short URL to export. If not provided, uses the stored short URL.
+            since (int, optional): Only include clicks at or after this time, in seconds since the epoch.
+            until (int, optional): Only include clicks before this time, in seconds since the epoch.
+            chunk_size (int, optional): The number of rows fetched per query.
+
+        Yields:
+            dict: The Stat column values of each click.
+        """
+
+        if short_url is None:
+            short_url = self.short_url
+
+        columns = Stat.__table__.c
+        query = select(columns).where(columns.short_url == short_url)
+        if since is not None:
+            query = query.where(columns.entry_time >= since)
+        if until is not None:
+            query = query.where(columns.entry_time < until)
+
+        last_id = 0
+        while True:
+            rows = (
+                db.session.execute(
+                    query.where(columns.id > last_id)
+                    .order_by(columns.id)
+                    .limit(chunk_size)
+                )
+                .mappings()
+                .all()
+            )
+            # End the read transaction between chunks, so a slow consumer never holds up writers.
+            db.session.commit()
+
+            for row in rows:
+                yield dict(row)
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1]["id"]
+
+    def delete(self, short_urls=None):
+        """
+        Delete all records associated with short URLs from the database.
+
+        Records are removed with set-based deletes of at most DELETE_CHUNK_SIZE rows, each in its own transaction,
+        followed by the URLs' click counters, hourly click counts, and unique visitor sketches.
+
+        Args:
+            short_urls (list, optional): The short URLs whose records to delete. Defaults to the current short URL.
 
         Returns:
-            None
+            int: The number of records deleted.
         """
 
-        urls = db.session.query(Stat).where(Stat.short_url == self.short_url)
-        for url in urls:
-            db.session.delete(url)
+        if short_urls is None:
+            short_urls = [self.short_url]
+
+        columns = Stat.__table__.c
+        chunk_size = app.config["DELETE_CHUNK_SIZE"]
+        short_urls = list(short_urls)
+        deleted = 0
+
+        # Stay well below SQLite's limit on the number of bound parameters per query.
+        for start in range(0, len(short_urls), 500):
+            chunk = columns.short_url.in_(short_urls[start : start + 500])
+            while True:
+                ids = select(columns.id).where(chunk).limit(chunk_size)
+                count = db.session.execute(
+                    Stat.__table__.delete().where(columns.id.in_(ids))
+                ).rowcount
+                db.session.commit()
+                deleted += count
+                if count < chunk_size:
+                    break
+
+            for table in (
+                Rollup.__table__,
+                ClickBucket.__table__,
+                UniqueSketch.__table__,
+            ):
+                db.session.execute(
+                    table.delete().where(
+                        table.c.short_url.in_(short_urls[start : start + 500])
+                    )
+                )
             db.session.commit()
+
+        return deleted
+
+
+tracker = Tracker(
+    Analyzer().persist,
+    maxsize=app.config["TRACKING_QUEUE_SIZE"],
+    workers=app.config["TRACKING_WORKERS"],
+    overflow=app.config["TRACKING_OVERFLOW"],
+    block_timeout=app.config["TRACKING_BLOCK_TIMEOUT"],
+    on_idle=writer.flush,
+)
@@ -7,8 +7,14 @@ It uses JWT tokens for user authentication and authorization, communicating with
 Author: Yousef Saeed
 """
 
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
 from functools import wraps
+from json import JSONDecoder, JSONDecodeError, dumps
+from codecs import getincrementaldecoder
+from itertools import chain
+from os import getpid
+from io import StringIO
+import csv
 from jwt import decode
 from re import match
 import datetime
@@ -16,6 +22,11 @@ import datetime
 from database import *
 from shortener import *
 from analyzer import *
+from rollups import time_series, unique_visitors
+from analyzer import user_agents, tracker
+from geolocation import locator
+from writer import writer
+from allocator import allocator
 
 
 analyzer = Analyzer()
@@ -52,6 +63,232 @@ def token_required(f):
     return wrapper
 
 
+def read_json_records(stream, chunk_size=65536, max_record_size=65536):
+    """
+    Read JSON records from a request body incrementally, without loading the whole body into memory.
+
+    The body is either a JSON array or NDJSON (one JSON value per line).
+    An array's commas and brackets are checked as they're read, and the first syntax error ends it.
+    Only the record being parsed is kept in memory, and a record longer than max_record_size is reported as
+    an error instead of being read to its end, so a malformed or oversized record can't pull in the rest of the body.
+
+    Args:
+        stream: The request body stream.
+        chunk_size (int, optional): The number of bytes read at a time.
+        max_record_size (int, optional): The maximum length of a record, in characters.
+
+    Yields:
+        tuple: The record's line (or array position) number, starting at 1, and either the record or a JSONDecodeError.
+    """
+
+    decoder = JSONDecoder()
+    utf8 = getincrementaldecoder("utf-8")(errors="replace")
+
+    def chunks():
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                yield utf8.decode(b"", final=True)
+                return
+            yield utf8.decode(chunk)
+
+    chunks = chunks()
+    buffer = ""
+    # Where parsing is in the buffer; what comes before it has been parsed.
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        if eof:
+            return False
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            return False
+        # Drop what's been parsed, so only the unparsed remainder stays in memory.
+        buffer, position = buffer[position:] + chunk, 0
+        return True
+
+    # Tell an array from NDJSON by the first non-whitespace character.
+    while not buffer.strip() and fill():
+        pass
+    buffer = buffer.lstrip()
+    if not buffer:
+        return
+
+    if not buffer.startswith("["):
+        number = 0
+        # Whether the rest of an oversized line is being skipped.
+        skipping = False
+        while True:
+            lines = buffer.split("\n")
+            buffer = lines.pop()
+            if eof:
+                lines.append(buffer)
+                buffer = ""
+            for line in lines:
+                if skipping:
+                    skipping = False
+                    continue
+                number += 1
+                if len(line) > max_record_size:
+                    yield number, JSONDecodeError("Record too large", line, 0)
+                elif line.strip():
+                    try:
+                        yield number, decoder.decode(line)
+                    except JSONDecodeError as error:
+                        yield number, error
+            if eof:
+                return
+            if len(buffer) > max_record_size:
+                if not skipping:
+                    number += 1
+                    yield number, JSONDecodeError("Record too large", buffer, 0)
+                    skipping = True
+                buffer = ""
+            fill()
+
+    position = 1
+    number = 0
+    # What comes next: "first" for a value or the end of an empty array, "value" for a value after a comma,
+    # and "delimiter" for a comma or the end of the array after a value.
+    expecting = "first"
+    while True:
+        # Skip whitespace, reading more of the body as needed.
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position < len(buffer) or not fill():
+                break
+        if position >= len(buffer):
+            yield number + 1, JSONDecodeError("Unterminated array", buffer, position)
+            return
+
+        if expecting == "delimiter":
+            if buffer[position] == "]":
+                break
+            if buffer[position] != ",":
+                yield number + 1, JSONDecodeError(
+                    "Expecting ',' delimiter", buffer, position
+                )
+                return
+            position += 1
+            expecting = "value"
+            continue
+        if expecting == "first" and buffer[position] == "]":
+            break
+
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except JSONDecodeError as error:
+            # A value cut short by the end of what's been read may parse once more is read. Errors are reported
+            # within an escape's length of where the value was cut, except unterminated strings,
+            # which are reported where they start.
+            truncated = error.pos >= len(buffer) - 6 or error.msg.startswith(
+                "Unterminated string"
+            )
+            if truncated and len(buffer) - position <= max_record_size and fill():
+                continue
+            if truncated and len(buffer) - position > max_record_size:
+                error = JSONDecodeError("Record too large", buffer, position)
+            yield number + 1, error
+            return
+
+        # A value running to the end of what's been read may be cut short, like a number split across reads,
+        # which parses as a shorter number followed by the rest of its characters.
+        rest = end
+        while rest < len(buffer) and buffer[rest] in "0123456789+-.eE":
+            rest += 1
+        if rest == len(buffer) and not eof:
+            if len(buffer) - position > max_record_size:
+                yield number + 1, JSONDecodeError("Record too large", buffer, position)
+                return
+            if fill():
+                continue
+
+        if end - position > max_record_size:
+            yield number + 1, JSONDecodeError("Record too large", buffer, position)
+            return
+        if end < len(buffer) and buffer[end] not in " \t\r\n,]":
+            yield number + 1, JSONDecodeError("Expecting ',' delimiter", buffer, end)
+            return
+
+        number += 1
+        yield number, record
+        position = end
+        expecting = "delimiter"
+
+    # Nothing but whitespace may follow the end of the array.
+    position += 1
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n":
+            position += 1
+        if position < len(buffer):
+            yield number + 1, JSONDecodeError("Extra data", buffer, position)
+            return
+        if not fill():
+            return
+
+
+def validate_shorten(data, user):
+    """
+    Validate a URL to shorten, with the rules shared by /api/shorten and /api/shorten/bulk.
+
+    Args:
+        data (dict): The URL and its optional exp_date and is_permanent parameters.
+        user (User): The authenticated user (or None for unauthenticated requests).
+
+    Returns:
+        tuple: An error message (or None if the URL is valid) and the keyword arguments for Shortener.shorten_url().
+    """
+
+    if not isinstance(data, dict) or "url" not in data:
+        return "Missing required parameter. url:str.", None
+    elif not isinstance(data["url"], str) or len(data["url"]) == 0:
+        return "URL cannot be empty.", None
+    elif len(data["url"]) > 2048:
+        return "URL must be less than 2048 characters long.", None
+    elif len(data["url"]) < 6:
+        return "URL must be more than 6 characters long.", None
+    elif not match(
+        r"^(https?://)?([A-Za-z0-9]+(?:-[A-Za-z0-9]+)*\.)+[A-Za-z]{2,}$",
+        data["url"],
+    ):
+        return "Invalid URL.", None
+    elif user is None:
+        return None, {"long_url": data["url"]}
+
+    is_permanent = str(data.get("is_permanent", "False")).title()
+    if is_permanent not in ["True", "False"]:
+        return "'is_permanent' must be a boolean value (True or False).", None
+    elif is_permanent == "True" and "exp_date" in data:
+        return "Permanent URLs cannot have an expiration date.", None
+    elif is_permanent == "True":
+        return None, {"long_url": data["url"], "is_permanent": True, "user_id": user.id}
+    elif "exp_date" not in data:
+        return None, {"long_url": data["url"], "user_id": user.id}
+
+    if Shortener().check_datetime_format(data["exp_date"]) is False:
+        return "Expiration date must be in the '%d-%m-%Y.%H:%M' format.", None
+
+    current_time = datetime.datetime.now().replace(second=0, microsecond=0)
+    exp_date = datetime.datetime.strptime(data["exp_date"], "%d-%m-%Y.%H:%M")
+    if exp_date < current_time + datetime.timedelta(
+        minutes=5
+    ) or exp_date > current_time + datetime.timedelta(days=365 * 50):
+        return (
+            "Expiration date must be between 5 minutes from now and 50 years in the future.",
+            None,
+        )
+
+    return None, {
+        "long_url": data["url"],
+        "expiration_date": exp_date.strftime("%d-%m-%Y.%H:%M"),
+        "user_id": user.id,
+    }
+
+
 @app.route("/api/shorten", methods=["POST"])
 @token_required
 def api_shorten(user):
@@ -67,146 +304,77 @@ def api_shorten(user):
 
     try:
         data = request.get_json()
-        if "url" not in data and user is not None:
-            return (
-                jsonify(
-                    {
-                        "error": "Missing required parameter. url:str",
-                        "optional_parameters": "exp_date:str(%d-%m-%Y.%H:%M), is_permanent:boolean",
-                    }
-                ),
-                400,
-            )
-        elif "url" not in data and user is None:
-            return jsonify({"error": "Missing required parameter. url:str."}), 400
-        elif len(data["url"]) == 0:
-            return jsonify({"error": "URL cannot be empty."}), 400
-        elif len(data["url"]) > 2048:
-            return (
-                jsonify({"error": "URL must be less than 2048 characters long."}),
-                400,
-            )
-        elif len(data["url"]) < 6:
-            return jsonify({"error": "URL must be more than 6 characters long."}), 400
-        elif not match(
-            r"^(https?://)?([A-Za-z0-9]+(?:-[A-Za-z0-9]+)*\.)+[A-Za-z]{2,}$",
-            data["url"],
-        ):
-            return jsonify({"error": "Invalid URL."}), 400
-        elif user is None:
-            short_url = Shortener().shorten_url(data["url"])
-            return (
-                jsonify({"message": "URL shortened successfully!", "url": short_url}),
-                200,
-            )
-        elif user is not None:
-            if "is_permanent" in data and data["is_permanent"].title() not in [
-                "True",
-                "False",
-            ]:
-                return (
-                    jsonify(
-                        {
-                            "error": "'is_permanent' must be a boolean value (True or False)."
-                        }
-                    ),
-                    400,
-                )
-            elif (
-                "is_permanent" in data
-                and "exp_date" in data
-                and data["is_permanent"].title() == "True"
-            ):
-                return (
-                    jsonify(
-                        {"error": "Permanent URLs cannot have an expiration date."}
-                    ),
-                    400,
-                )
-            elif (
-                "exp_date" not in data
-                and "is_permanent" in data
-                and data["is_permanent"].title() == "True"
-            ):
-                short_url = Shortener().shorten_url(
-                    data["url"],
-                    is_permanent=True,
-                    user_id=user.id,
-                )
-                return (
-                    jsonify(
-                        {
-                            "message": "URL shortened successfully!",
-                            "url": short_url,
-                        }
-                    ),
-                    200,
-                )
-            elif "exp_date" in data:
-                if Shortener().check_datetime_format(data["exp_date"]) is False:
-                    return (
-                        jsonify(
-                            {
-                                "error": "Expiration date must be in the '%d-%m-%Y.%H:%M' format."
-                            }
-                        ),
-                        400,
-                    )
-
-                current_time = datetime.datetime.now()
-                exp_date_min = datetime.datetime.strptime(
-                    (current_time + datetime.timedelta(minutes=5)).strftime(
-                        "%d-%m-%Y.%H:%M"
-                    ),
-                    "%d-%m-%Y.%H:%M",
-                )
-                exp_date_max = datetime.datetime.strptime(
-                    (current_time + datetime.timedelta(days=365 * 50)).strftime(
-                        "%d-%m-%Y.%H:%M"
-                    ),
-                    "%d-%m-%Y.%H:%M",
-                )
-                exp_date = datetime.datetime.strptime(
-                    data["exp_date"],
-                    "%d-%m-%Y.%H:%M",
+        error, kwargs = validate_shorten(data, user)
+        if error is not None:
+            response = {"error": error}
+            if user is not None and (not isinstance(data, dict) or "url" not in data):
+                response["optional_parameters"] = (
+                    "exp_date:str(%d-%m-%Y.%H:%M), is_permanent:boolean"
                 )
+            return jsonify(response), 400
 
-                if exp_date < exp_date_min or exp_date > exp_date_max:
-                    return (
-                        jsonify(
-                            {
-                                "error": "Expiration date must be between 5 minutes from now and 50 years in the future."
-                            }
-                        ),
-                        400,
-                    )
-                else:
-                    short_url = Shortener().shorten_url(
-                        data["url"],
-                        expiration_date=exp_date.strftime("%d-%m-%Y.%H:%M"),
-                        user_id=user.id,
-                    )
-                    return (
-                        jsonify(
-                            {
-                                "message": "URL shortened successfully!",
-                                "url": short_url,
-                            }
-                        ),
-                        200,
-                    )
-            else:
-                short_url = Shortener().shorten_url(data["url"], user_id=user.id)
-                return (
-                    jsonify(
-                        {"message": "URL shortened successfully!", "url": short_url}
-                    ),
-                    200,
-                )
+        short_url = Shortener().shorten_url(**kwargs)
+        return (
+            jsonify({"message": "URL shortened successfully!", "url": short_url}),
+            200,
+        )
     except:
         return jsonify({"error": "No data provided."}), 400
 
 
+@app.route("/api/shorten/bulk", methods=["POST"])
+@token_required
+def api_shorten_bulk(user):
+    """
+    Shorten many URLs via the API.
+
+    The body is a JSON array or NDJSON of the same objects /api/shorten takes, and is read incrementally.
+    Records are handled in chunks of BULK_SHORTEN_CHUNK_SIZE, storing each chunk's URLs in one transaction,
+    and one NDJSON result line is streamed back per record as each chunk is stored.
+
+    Args:
+        user (User): The authenticated user (or None for unauthenticated requests).
+
+    Returns:
+        Response: A streamed NDJSON response with each record's line number and short URL or error.
+    """
+
+    if user is None:
+        return jsonify({"error": "No token provided."}), 401
+
+    chunk_size = app.config["BULK_SHORTEN_CHUNK_SIZE"]
+    shortener = Shortener()
+
+    def store(results, valid):
+        short_urls = iter(shortener.shorten_urls(valid))
+        for result in results:
+            if "error" not in result:
+                result["url"] = next(short_urls)
+            yield dumps(result) + "\n"
+
+    def generate():
+        results, valid = [], []
+        for line, record in read_json_records(request.stream):
+            if isinstance(record, JSONDecodeError):
+                results.append({"line": line, "error": "Invalid JSON."})
+            else:
+                error, kwargs = validate_shorten(record, user)
+                if error is not None:
+                    results.append({"line": line, "error": error})
+                else:
+                    results.append({"line": line})
+                    valid.append(kwargs)
+
+            # Errors count towards the chunk too, so a body of invalid records isn't collected in memory.
+            if len(results) >= chunk_size:
+                yield from store(results, valid)
+                results, valid = [], []
+
+        yield from store(results, valid)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @app.route("/api/get", methods=["GET"])
 @token_required
 def api_get(user):
@@ -241,30 +409,53 @@ def api_get(user):
                 else:
                     return jsonify({"error": "URL doesn't exist."})
     except:
-        urls = db.session.query(Url).where(Url.user_id == user.id)
-        if urls.count() <= 0:
-            return jsonify({"message": "You have no URLs."}), 200
-        elif urls.count() > 0:
-            json_urls = []
-            for url in urls:
-                json_url = {
-                    "short_url": url.short_url,
-                    "long_url": url.long_url,
-                }
-                json_urls.append(json_url)
-
-            return jsonify(json_urls), 200
-        else:
+        try:
+            limit = request.args.get("limit")
+            if limit is not None:
+                limit = int(limit)
+            cursor = request.args.get("cursor")
+            if cursor is not None:
+                decode_cursor(cursor)
+        except ValueError:
+            limit = -1
+        if limit is not None and not 0 < limit <= app.config["API_MAX_PAGE_SIZE"]:
             return (
                 jsonify(
                     {
                         "error": "An error occurred.",
-                        "usage": "Run without any arguments to get all URLs, or pass a URL in the JSON field url:str to get information about a specific URL.",
+                        "usage": f"Run without any arguments to get all URLs, pass limit (1 to {app.config['API_MAX_PAGE_SIZE']}) and the returned cursor in the query string to get them a page at a time, or pass a URL in the JSON field url:str to get information about a specific URL.",
                     }
                 ),
                 400,
             )
 
+        # With a limit or cursor, return one page and the cursor of the next.
+        if limit is not None or cursor is not None:
+            urls, next_cursor = Shortener().list_urls(
+                user.id, limit or app.config["API_MAX_PAGE_SIZE"], cursor
+            )
+            json_urls = [
+                {"short_url": url.short_url, "long_url": url.long_url} for url in urls
+            ]
+            return jsonify({"urls": json_urls, "next_cursor": next_cursor}), 200
+
+        # Otherwise, stream every URL as a single JSON array, one page at a time.
+        urls = Shortener().iter_urls(user.id)
+        first_url = next(urls, None)
+        if first_url is None:
+            return jsonify({"message": "You have no URLs."}), 200
+
+        def generate():
+            separator = "["
+            for url in chain([first_url], urls):
+                yield separator + dumps(
+                    {"short_url": url.short_url, "long_url": url.long_url}
+                )
+                separator = ","
+            yield "]"
+
+        return Response(stream_with_context(generate()), mimetype="application/json")
+
 
 @app.route("/api/update", methods=["PUT"])
 @token_required
@@ -330,9 +521,7 @@ def api_update(user):
             and "is_permanent" in data
             and data["is_permanent"].title() == "True"
         ):
-            url.is_permanent = True
-            url.expiration_date = None
-            db.session.commit()
+            Shortener().update_exp_date(url.short_url, None)
             return jsonify({"message": "URL updated successfully!"}), 200
         elif "exp_date" in data:
             if Shortener().check_datetime_format(data["exp_date"]) is False:
@@ -373,9 +562,9 @@ def api_update(user):
                     400,
                 )
             else:
-                url.is_permanent = False
-                url.expiration_date = exp_date.strftime("%d-%m-%Y.%H:%M")
-                db.session.commit()
+                Shortener().update_exp_date(
+                    url.short_url, exp_date.strftime("%d-%m-%Y.%H:%M")
+                )
                 return jsonify({"message": "URL updated successfully!"}), 200
     except:
         return jsonify({"error": "No data provided."}), 400
@@ -412,10 +601,7 @@ def api_delete(user):
         if url is None:
             return jsonify({"error": "URL doesn't exist."})
 
-        analyzer.short_url = url.short_url
-        analyzer.delete()
-        db.session.delete(url)
-        db.session.commit()
+        Shortener().delete_short_url(url.short_url)
         return jsonify({"message": "URL deleted successfully!"}), 200
     except:
         return jsonify({"error": "No data provided."}), 400
@@ -451,8 +637,7 @@ def api_stats(user):
                     short_url=data["url"], user_id=user.id
                 ).first()
                 if url is not None:
-                    analyzer.short_url = url.short_url
-                    stats = analyzer.analyze()
+                    stats = analyzer.analyze(url.short_url)
                     return (
                         jsonify(
                             {
@@ -461,7 +646,6 @@ def api_stats(user):
                                 "creation_date": url.creation_date,
                                 "expiration_date": url.expiration_date,
                                 "is_permanent": url.is_permanent,
-                                "entries": stats["entries"],
                                 "total_entries_count": stats["total_entries_count"],
                                 "total_unique_entries_count": stats[
                                     "total_unique_entries_count"
@@ -493,17 +677,17 @@ def api_stats(user):
         if urls.count() <= 0:
             return jsonify({"message": "You have no URLs."}), 200
         elif urls.count() > 0:
+            urls = urls.all()
+            url_stats = analyzer.analyze_many([url.short_url for url in urls])
             json_urls = []
             for url in urls:
-                analyzer.short_url = url.short_url
-                stats = analyzer.analyze()
+                stats = url_stats[url.short_url]
                 json_url = {
                     "short_url": url.short_url,
                     "long_url": url.long_url,
                     "creation_date": url.creation_date,
                     "expiration_date": url.expiration_date,
                     "is_permanent": url.is_permanent,
-                    "entries": stats["entries"],
                     "total_entries_count": stats["total_entries_count"],
                     "total_unique_entries_count": stats["total_unique_entries_count"],
                     "most_frequent_entry_time_of_day": stats[
@@ -538,5 +722,181 @@ def api_stats(user):
             )
 
 
+@app.route("/api/stats/export", methods=["GET"])
+@token_required
+def api_stats_export(user):
+    """
+    Stream the raw clicks of a URL via the API, as CSV or NDJSON.
+
+    The URL, format (ndjson or csv), and an optional time range (since and until, in seconds since the epoch)
+    are passed in the query string.
+
+    Args:
+        user (User): The authenticated user (or None for unauthenticated requests).
+
+    Returns:
+        Response: The streamed clicks, or a JSON error response.
+    """
+
+    if user is None:
+        return jsonify({"error": "No token provided."}), 401
+
+    short_url = request.args.get("url", "")
+    export_format = request.args.get("format", "ndjson")
+    try:
+        since, until = (
+            int(request.args[name]) if name in request.args else None
+            for name in ("since", "until")
+        )
+    except ValueError:
+        since = until = export_format = None
+    if not 4 <= len(short_url) <= 12 or export_format not in ("ndjson", "csv"):
+        return (
+            jsonify(
+                {
+                    "error": "An error occurred.",
+                    "usage": "Pass a URL as url, and optionally format (ndjson or csv) and a time range as since and until (seconds since the epoch), in the query string.",
+                }
+            ),
+            400,
+        )
+
+    url = Url.query.filter_by(short_url=short_url, user_id=user.id).first()
+    if url is None:
+        return jsonify({"error": "URL doesn't exist."})
+
+    clicks = Analyzer().export(url.short_url, since, until)
+
+    def generate_ndjson():
+        for click in clicks:
+            yield dumps(click) + "\n"
+
+    def generate_csv():
+        buffer = StringIO()
+        csv_writer = csv.writer(buffer)
+        columns = [column.name for column in Stat.__table__.columns]
+        csv_writer.writerow(columns)
+        for number, click in enumerate(clicks, 1):
+            csv_writer.writerow(click[column] for column in columns)
+            # Send rows in batches rather than one tiny write per click.
+            if number % 1000 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    if export_format == "csv":
+        body, mimetype = generate_csv(), "text/csv"
+    else:
+        body, mimetype = generate_ndjson(), "application/x-ndjson"
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename={url.short_url}.{export_format}"
+        },
+    )
+
+
+@app.route("/api/stats/timeseries", methods=["GET"])
+@token_required
+def api_stats_timeseries(user):
+    """
+    Retrieve the number of clicks on a URL per hour or day via the API.
+
+    The URL, interval (hour or day), and an optional time range (since and until, in seconds since the epoch)
+    are passed in the query string.
+
+    Args:
+        user (User): The authenticated user (or None for unauthenticated requests).
+
+    Returns:
+        JSON response: JSON response with the number of clicks in each interval, and the unique visitors in the range.
+    """
+
+    if user is None:
+        return jsonify({"error": "No token provided."}), 401
+
+    intervals = {"hour": 3600, "day": 86400}
+    short_url = request.args.get("url", "")
+    interval = request.args.get("interval", "hour")
+    try:
+        since, until = (
+            int(request.args[name]) if name in request.args else None
+            for name in ("since", "until")
+        )
+    except ValueError:
+        since = until = interval = None
+    if not 4 <= len(short_url) <= 12 or interval not in intervals:
+        return (
+            jsonify(
+                {
+                    "error": "An error occurred.",
+                    "usage": "Pass a URL as url, and optionally interval (hour or day) and a time range as since and until (seconds since the epoch), in the query string.",
+                }
+            ),
+            400,
+        )
+
+    url = Url.query.filter_by(short_url=short_url, user_id=user.id).first()
+    if url is None:
+        return jsonify({"error": "URL doesn't exist."})
+
+    points = time_series(url.short_url, intervals[interval], since, until)
+    return (
+        jsonify(
+            {
+                "short_url": url.short_url,
+                "interval": interval,
+                "unique_entries": unique_visitors(url.short_url, since, until),
+                "points": [
+                    {"time": start, "entries": entries} for start, entries in points
+                ],
+            }
+        ),
+        200,
+    )
+
+
+@app.route("/api/metrics", methods=["GET"])
+@token_required
+def api_metrics(user):
+    """
+    Retrieve the metrics of the process serving the request via the API, for monitoring.
+
+    They cover the resolution, geolocation, and user agent caches, the batched click writer and tracker queue,
+    and the short URL pool (None unless SHORT_CODE_ALLOCATOR is "pool").
+
+    Every worker process has its own caches, so the metrics describe the worker identified by pid.
+
+    Args:
+        user (User): The authenticated user (or None for unauthenticated requests).
+
+    Returns:
+        JSON response: JSON response with the process's metrics.
+    """
+
+    if user is None:
+        return jsonify({"error": "No token provided."}), 401
+
+    return (
+        jsonify(
+            {
+                "pid": getpid(),
+                "resolution": resolution_stats(),
+                "geolocation": locator.stats(),
+                "user_agents": user_agents.stats(),
+                "writer": writer.stats(),
+                "tracker": tracker.stats(),
+                "short_codes": (
+                    allocator.stats() if hasattr(allocator, "stats") else None
+                ),
+            }
+        ),
+        200,
+    )
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -4,39 +4,130 @@ URL Shortener Web Application Main Script
 This script serves as the entry point for the URL shortener web application.
 Providing functionality for both the web application and the API.
 
+Run it directly for the development server, or serve it with Gunicorn in production:
+
+    gunicorn -c gunicorn.conf.py app:app
+
 Author: Yousef Saeed
 """
 
-from multiprocessing import Process
-from time import sleep
+from threading import Thread
 
 from database import *
 from views import *
 from api import *
+from analyzer import parse_user_agent, tracker
+from writer import writer
+from leader import LeaderLock
+from scheduler import scheduler
 
 
 def check_expired_urls():
     """
-    Function to periodically check and delete expired URLs.
+    Function to delete expired URLs and their analytics data in the background.
+
+    Expired URLs already stop redirecting when they expire, so this only reclaims their rows.
+    It runs the expiry scheduler, which sleeps until the soonest expiration date is due, at most once every
+    EXPIRY_SWEEP_INTERVAL seconds, and then deletes every expired URL in batches. Each sweep's count and duration
+    are printed, and so are database errors, after which the sweep is retried.
+
+    This function is intended to be run in a background thread of a single process, see run_sweeper().
+    """
+
+    scheduler.run(
+        on_sweep=lambda sweep: print(
+            f"Expiry sweep: {sweep['reaped']} URLs reaped in {sweep['duration']:.3f}s",
+            flush=True,
+        ),
+        on_error=lambda error: print(f"Expiry sweep failed: {error}", flush=True),
+    )
+
+
+def run_sweeper():
+    """
+    Wait to be elected the sweeper, then check for expired URLs for as long as the process lives.
+
+    Every worker runs this, but only the one holding the SWEEPER_LOCK lock file sweeps,
+    so adding workers doesn't multiply sweeps. When the sweeping worker exits, a waiting one takes over.
+
+    Returns:
+        None
+    """
+
+    # The lock is held for as long as the lock object lives, so keep it until the sweeper stops.
+    lock = LeaderLock(app.config["SWEEPER_LOCK"])
+    lock.acquire()
+    check_expired_urls()
+
+
+def start_sweeper():
+    """
+    Run the sweeper election in a background thread of the current process.
+
+    Returns:
+        Thread: The sweeper thread.
+    """
+
+    thread = Thread(target=run_sweeper, name="sweeper", daemon=True)
+    thread.start()
+    return thread
+
+
+def warm_up():
+    """
+    Do the expensive first-use work of a worker once, before the workers are forked, so they share the results.
 
-    This function runs in a loop and periodically checks for expired URLs using the Shortener class.
-    If an expired URL is found, it will be deleted. It sleeps for 60 seconds between checks.
+    Templates are compiled, the user agent parser's patterns are built, and the WARM_CACHE_SIZE most clicked
+    short URLs are resolved into the resolution cache.
+    Database connections opened along the way are closed, so forked workers don't share them.
 
-    This function is intended to be run in a separate process.
+    Returns:
+        dict: The number of templates compiled and short URLs cached.
     """
 
+    templates = app.jinja_env.list_templates()
+    for template in templates:
+        app.jinja_env.get_template(template)
+
+    parse_user_agent(
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    )
+
     with app.app_context():
-        shortener = Shortener()
-        while True:
-            shortener.delete_expired_urls()
-            sleep(60)
+        cached = 0
+        if app.config["WARM_CACHE_SIZE"] > 0 and app.config["RESOLVE_CACHE_SIZE"] > 0:
+            hot_urls = db.session.scalars(
+                db.select(Rollup.short_url)
+                .where(Rollup.dimension == "clicks")
+                .order_by(Rollup.entries.desc())
+                .limit(
+                    min(app.config["WARM_CACHE_SIZE"], app.config["RESOLVE_CACHE_SIZE"])
+                )
+            ).all()
+            cached = Shortener().preload(hot_urls)
 
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+    return {"templates": len(templates), "urls": cached}
 
-if __name__ == "__main__":
-    # Create a separate process to run the URL expiration checker
-    p_check_expired_urls = Process(target=check_expired_urls)
-    p_check_expired_urls.start()
 
-    # Create a separate process to run the Flask application
-    p_app = Process(target=app.run())
-    p_app.start()
+def shut_down():
+    """
+    Store every click still queued or buffered in the current process, before it exits.
+
+    Returns:
+        None
+    """
+
+    tracker.stop()
+    with app.app_context():
+        writer.flush()
+
+
+if __name__ == "__main__":
+    # Check for expired URLs in a background thread of the development server.
+    start_sweeper()
+    app.run()
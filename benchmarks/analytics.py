@@ -0,0 +1,228 @@
+"""
+Analytics Benchmark
+
+This script measures how long Analyzer.analyze() takes to build a short URL's statistics,
+compared with the original implementation that ran a dozen separate queries, and checks that both produce the same output.
+
+It builds a throwaway database in a temporary directory with one short URL per requested size
+(10k, 100k, and 1M clicks by default), surrounded by clicks on other URLs.
+Set UNIQUE_COUNT=exact to compare exact unique visitor counts instead of estimates.
+
+Usage:
+    python benchmarks/analytics.py [clicks ...]
+
+Author: Yousef Saeed
+"""
+
+from os.path import dirname, abspath
+from math import isclose
+from random import Random
+from tempfile import mkdtemp
+from time import perf_counter
+import datetime
+import os
+import sys
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+# Point the app at a throwaway database before it's imported.
+os.chdir(mkdtemp())
+os.environ["DB"] = "benchmark"
+
+from sqlalchemy import func, insert
+from statistics import multimode
+
+from analyzer import *
+from hyperloglog import standard_error
+from rollups import rebuild_all
+
+
+def legacy_analyze(short_url):
+    """
+    The original implementation of Analyzer.analyze(), kept as a baseline.
+
+    It is adapted to the typed stats columns: entry times are converted from epochs instead of parsed from strings,
+    and averages no longer need a CAST. Like the current payload, it no longer lists every entry.
+
+    Args:
+        short_url (str): The short URL to analyze.
+
+    Returns:
+        dict: The statistics of the short URL.
+    """
+
+    where = Stat.short_url == short_url
+
+    total_entries_count = db.session.query(Stat).where(where).count()
+    total_unique_entries_count = (
+        db.session.query(Stat).where(where).group_by(Stat.ip).count()
+    )
+
+    hours_list, days_list, months_list = [], [], []
+    for url in db.session.query(Stat).where(where):
+        entry_time = datetime.datetime.fromtimestamp(url.entry_time)
+        hours_list.append(entry_time.strftime("%H"))
+        days_list.append(entry_time.strftime("%d"))
+        months_list.append(entry_time.strftime("%m"))
+
+    def average(column):
+        return db.session.query(func.avg(column)).where(where).scalar()
+
+    def top(column, name, limit):
+        rows = (
+            db.session.query(column, func.count(column))
+            .where(where)
+            .group_by(column)
+            .order_by(func.count(column).desc())
+            .limit(limit)
+            .all()
+        )
+        return [{name: row[0], "count": row[1]} for row in rows]
+
+    return {
+        "total_entries_count": total_entries_count,
+        "total_unique_entries_count": total_unique_entries_count,
+        "most_frequent_entry_time_of_day": multimode(hours_list),
+        "most_frequent_entry_time_of_month": multimode(days_list),
+        "most_frequent_entry_time_of_year": multimode(months_list),
+        "average_response_time": average(Stat.response_time),
+        "top_platforms": top(Stat.platform, "platform", 3),
+        "top_browsers": top(Stat.browser, "browser", 3),
+        "top_countries": top(Stat.country, "country", 10),
+        "top_regions": top(Stat.region, "region", 10),
+        "top_cities": top(Stat.city, "city", 10),
+        "average_distance": average(Stat.distance),
+    }
+
+
+def generate_clicks(short_url, clicks, random):
+    """
+    Generate realistic Stat rows for a short URL.
+
+    Args:
+        short_url (str): The short URL that was clicked.
+        clicks (int): The number of clicks.
+        random (Random): The random number generator.
+
+    Yields:
+        dict: The Stat column values of each click.
+    """
+
+    start = int(datetime.datetime(2023, 1, 1).timestamp())
+    platforms = ["Windows", "Android", "iOS", "Mac OS X", "Linux", None]
+    browsers = ["Chrome-120.0", "Safari-17.1", "Firefox-121.0", "Edge-120.0"]
+    countries = ["US", "EG", "DE", "IN", "BR", "GB", "FR", "JP", "NG", "CA", "MX"]
+
+    for _ in range(clicks):
+        country = random.choice(countries)
+        yield {
+            "short_url": short_url,
+            "entry_time": start + random.randrange(365 * 86400),
+            "response_time": random.random() / 10,
+            "platform": random.choice(platforms),
+            "browser": random.choice(browsers),
+            "ip": f"10.{random.randrange(256)}.{random.randrange(256)}.{random.randrange(8)}",
+            "city": f"{country}-city-{random.randrange(40)}",
+            "region": f"{country}-region-{random.randrange(15)}",
+            "country": country,
+            "latitude": random.uniform(-90, 90),
+            "longitude": random.uniform(-180, 180),
+            "distance": random.uniform(0, 15000),
+        }
+
+
+def populate(sizes, random):
+    """
+    Fill the database with one short URL per size, plus clicks on an unrelated URL, and build their click counters.
+
+    Args:
+        sizes (list): The number of clicks of each benchmarked short URL.
+        random (Random): The random number generator.
+
+    Returns:
+        None
+    """
+
+    db.create_all()
+    for short_url, clicks in [("noise", max(sizes) // 10)] + [
+        (f"b{clicks}", clicks) for clicks in sizes
+    ]:
+        rows = []
+        for row in generate_clicks(short_url, clicks, random):
+            rows.append(row)
+            if len(rows) == 10000:
+                db.session.execute(insert(Stat), rows)
+                rows = []
+        if rows:
+            db.session.execute(insert(Stat), rows)
+        db.session.commit()
+    rebuild_all()
+
+
+def same_top(expected, actual):
+    """
+    Check that two top-N lists are equal, ignoring the order of values with the same count.
+
+    SQL leaves the order of tied groups undefined, and which tied values make the cut at the limit is arbitrary,
+    so only the counts and the values above the lowest count are compared.
+    """
+
+    counts = [item["count"] for item in expected]
+    if counts != [item["count"] for item in actual]:
+        return False
+
+    def above_cut(items):
+        return {
+            tuple(sorted(item.items(), key=str))
+            for item in items
+            if item["count"] > min(counts)
+        }
+
+    return not counts or above_cut(expected) == above_cut(actual)
+
+
+def same_stats(expected, actual):
+    """
+    Check that two statistics payloads are equal, allowing rounding differences in averages and tie order in top lists.
+
+    With UNIQUE_COUNT=approx, unique visitor estimates may be off by up to three standard errors.
+    """
+
+    for key, value in expected.items():
+        if key == "total_unique_entries_count" and app.config["UNIQUE_COUNT"] == "approx":
+            error = 3 * standard_error(app.config["HLL_PRECISION"])
+            if not isclose(value, actual[key], rel_tol=error):
+                return False
+        elif key.startswith("average_"):
+            if not isclose(value, actual[key], rel_tol=1e-9):
+                return False
+        elif key.startswith("top_"):
+            if not same_top(value, actual[key]):
+                return False
+        elif value != actual[key]:
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] or [10000, 100000, 1000000]
+
+    with app.app_context():
+        populate(sizes, Random(0))
+        analyzer = Analyzer()
+
+        print(f"{'clicks':>10} {'legacy':>10} {'analyze':>10} {'speedup':>8}  same output")
+        for clicks in sizes:
+            short_url = f"b{clicks}"
+
+            start_time = perf_counter()
+            expected = legacy_analyze(short_url)
+            legacy = perf_counter() - start_time
+
+            start_time = perf_counter()
+            actual = analyzer.analyze(short_url)
+            current = perf_counter() - start_time
+
+            print(
+                f"{clicks:>10} {legacy:>9.3f}s {current:>9.3f}s {legacy / current:>7.1f}x  {same_stats(expected, actual)}"
+            )
@@ -0,0 +1,150 @@
+"""
+Concurrency Benchmark
+
+This script measures redirect throughput under contention with each storage profile (DB_PROFILE),
+and with clicks stored in a separate database (STATS_DB).
+Worker threads follow short URLs as fast as they can, with every click tracked synchronously,
+while a separate process keeps creating short URLs that expire right away and sweeping them,
+like the expiry checker does.
+
+Every profile runs in a fresh process against its own throwaway database, with the resolution cache disabled
+so every redirect reads the database.
+
+Usage:
+    python benchmarks/concurrency.py [threads] [seconds]
+
+Author: Yousef Saeed
+"""
+
+from os.path import dirname, abspath
+from tempfile import mkdtemp
+from threading import Thread
+from time import perf_counter, sleep
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+# The settings of each measured configuration.
+PROFILES = {
+    "default": {"DB_PROFILE": "default"},
+    "throughput": {"DB_PROFILE": "throughput"},
+    "split": {"DB_PROFILE": "throughput", "STATS_DB": "benchmark_clicks"},
+}
+
+
+def sweep(seconds):
+    """
+    Keep creating short URLs that have already expired and sweeping them until the time is up.
+
+    Args:
+        seconds (float): How long to keep going.
+
+    Returns:
+        None
+    """
+
+    from app import app, Shortener
+
+    with app.app_context():
+        shortener = Shortener()
+        deadline = perf_counter() + seconds
+        while perf_counter() < deadline:
+            try:
+                for _ in range(20):
+                    shortener.shorten_url(
+                        "https://example.com/expired", expiration_date="01-01-2000.00:00"
+                    )
+                shortener.delete_expired_urls()
+            except Exception:
+                pass
+            sleep(0.05)
+
+
+def run(threads, seconds):
+    """
+    Measure redirect throughput with the storage settings in the environment.
+
+    Args:
+        threads (int): The number of threads following short URLs.
+        seconds (float): How long to measure for.
+
+    Returns:
+        None
+    """
+
+    from multiprocessing import Process
+
+    from app import app, db, Shortener
+
+    with app.app_context():
+        db.create_all()
+        short_urls = [
+            Shortener().shorten_url(f"https://example.com/{number}")
+            for number in range(100)
+        ]
+
+    sweeper = Process(target=sweep, args=(seconds,))
+    sweeper.start()
+
+    redirects = [0] * threads
+    errors = [0] * threads
+    deadline = perf_counter() + seconds
+
+    def follow(worker):
+        client = app.test_client()
+        number = worker
+        while perf_counter() < deadline:
+            number += 1
+            try:
+                response = client.get(f"/{short_urls[number % len(short_urls)]}")
+                if response.status_code == 302:
+                    redirects[worker] += 1
+                else:
+                    errors[worker] += 1
+            except Exception:
+                errors[worker] += 1
+
+    workers = [Thread(target=follow, args=(worker,)) for worker in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    sweeper.join()
+
+    print(sum(redirects), sum(errors))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--run"]:
+        run(int(sys.argv[2]), float(sys.argv[3]))
+        sys.exit()
+
+    threads = int(sys.argv[1]) if sys.argv[1:] else 8
+    seconds = float(sys.argv[2]) if sys.argv[2:] else 10
+
+    print(f"{'profile':>10} {'threads':>8} {'redirects/s':>12} {'errors':>8}")
+    for profile, settings in PROFILES.items():
+        env = dict(
+            os.environ,
+            **settings,
+            DB="benchmark",
+            SECRET_KEY="benchmark",
+            TRACKING_MODE="sync",
+            RESOLVE_CACHE_SIZE="0",
+            RESOLVE_MISS_CACHE_SIZE="0",
+            GEO_FALLBACK="False",
+        )
+        output = subprocess.run(
+            [sys.executable, abspath(__file__), "--run", str(threads), str(seconds)],
+            env=env,
+            cwd=mkdtemp(),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        redirects, errors = map(int, output.split()[-2:])
+        print(
+            f"{profile:>10} {threads:>8} {redirects / seconds:>12.1f} {errors:>8}"
+        )
@@ -0,0 +1,100 @@
+"""
+User Agent Parsing Benchmark
+
+This script measures the cost of parsing the User-Agent of every click,
+with and without the memoization cache used by the Analyzer.
+
+The corpus mimics real traffic: a few dozen common browsers account for most clicks (Zipf-distributed),
+followed by a long tail of rarer versions and bots that are each seen only a handful of times.
+
+Usage:
+    python benchmarks/user_agents.py [clicks]
+
+Author: Yousef Saeed
+"""
+
+from os.path import dirname, abspath
+from random import Random
+from time import perf_counter
+import sys
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from ua_parser import user_agent_parser
+
+from analyzer import parse_user_agent, user_agents
+
+
+COMMON_USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_{v} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.{v} Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.{v} Safari/605.1.15",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:{v}.0) Gecko/20100101 Firefox/{v}.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36 Edg/{v}.0.0.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:{v}.0) Gecko/20100101 Firefox/{v}.0",
+    "Mozilla/5.0 (Linux; Android 13; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/{v}.0 Chrome/115.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (iPad; CPU OS 16_{v} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) CriOS/{v}.0.0.0 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (compatible; Googlebot/2.{v}; +http://www.google.com/bot.html)",
+    "facebookexternalhit/1.{v} (+http://www.facebook.com/externalhit_uatext.php)",
+    "Twitterbot/1.{v}",
+    "curl/8.{v}.0",
+    "python-requests/2.{v}.0",
+]
+
+
+def build_corpus(clicks, seed=0):
+    """
+    Build a skewed list of User-Agent strings.
+
+    Args:
+        clicks (int): The number of clicks to generate.
+        seed (int, optional): The random seed, so runs are comparable.
+
+    Returns:
+        list: The User-Agent of every click.
+    """
+
+    random = Random(seed)
+    # Every template/version pair is a distinct user agent, ranked by popularity.
+    ranked = [
+        template.format(v=version)
+        for version in range(120, 60, -1)
+        for template in COMMON_USER_AGENTS
+    ]
+    weights = [1 / rank for rank in range(1, len(ranked) + 1)]
+    return random.choices(ranked, weights=weights, k=clicks)
+
+
+def measure(parse, corpus):
+    """
+    Time parsing every User-Agent in a corpus.
+
+    Args:
+        parse (function): The parsing function.
+        corpus (list): The User-Agent strings.
+
+    Returns:
+        float: The average number of microseconds per click.
+    """
+
+    start_time = perf_counter()
+    for user_agent in corpus:
+        parse(user_agent)
+    return (perf_counter() - start_time) / len(corpus) * 1e6
+
+
+if __name__ == "__main__":
+    clicks = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    corpus = build_corpus(clicks)
+
+    uncached = measure(user_agent_parser.Parse, corpus)
+    user_agents.clear()
+    cached = measure(parse_user_agent, corpus)
+
+    print(f"clicks: {clicks}, distinct user agents: {len(set(corpus))}")
+    print(f"without cache: {uncached:10.2f} us/click")
+    print(f"with cache:    {cached:10.2f} us/click ({uncached / cached:.1f}x faster)")
+    print(f"cache: {user_agents.stats()}")
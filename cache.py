@@ -0,0 +1,139 @@
+"""
+Cache Module
+
+This module provides a small in-process cache used to avoid repeating expensive lookups.
+Entries are evicted when the cache is full (least recently used first) or when they are older than the cache's TTL.
+
+Classes:
+    - LRUCache: A thread-safe, size- and TTL-bounded least-recently-used cache with hit/miss counters.
+
+Author: Yousef Saeed
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LRUCache:
+    """
+    LRUCache is a class for caching values with size- and time-based eviction.
+
+    Attributes:
+        maxsize (int): The maximum number of entries.
+        ttl (float): The number of seconds an entry stays valid, or None to keep entries until evicted.
+        hits (int): The number of lookups that found a valid entry.
+        misses (int): The number of lookups that didn't.
+
+    Methods:
+        - get(key, default=None)
+        - set(key, value)
+        - delete(key)
+        - clear()
+        - stats()
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """
+        Initialize LRUCache with its size and TTL.
+
+        Args:
+            maxsize (int, optional): The maximum number of entries.
+            ttl (float, optional): The number of seconds an entry stays valid.
+        """
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Get a cached value, marking it as recently used.
+
+        Args:
+            key: The key to look up.
+            default (optional): The value to return if the key isn't cached or has expired.
+
+        Returns:
+            The cached value, or default.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """
+        Cache a value, evicting the least recently used entry if the cache is full.
+
+        Args:
+            key: The key to cache the value under.
+            value: The value to cache.
+
+        Returns:
+            None
+        """
+
+        expires = monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Remove a key from the cache, if it's cached.
+
+        Args:
+            key: The key to remove.
+
+        Returns:
+            None
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove every entry from the cache.
+
+        Returns:
+            None
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Get counters describing the cache's effectiveness.
+
+        Returns:
+            dict: The cache size, hits, misses, and hit ratio.
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0,
+        }
@@ -0,0 +1,54 @@
+"""
+Legacy Value Converters Module
+
+This module reads values stored in the formats of earlier schemas, like text entry times and numbers stored as text.
+They're shared by the migrations, which convert existing rows, and the click log importer, which accepts old exports.
+
+Functions:
+    - legacy_epoch(value): Convert a legacy entry time to seconds since the epoch.
+    - legacy_float(value): Convert a number stored as text to a float.
+
+Author: Yousef Saeed
+"""
+
+import datetime
+
+
+def legacy_epoch(value):
+    """
+    Convert an entry time stored in the legacy "%d-%m-%Y.%H:%M:%S" format to seconds since the epoch.
+
+    Args:
+        value: The stored entry time, either a legacy string or already a number.
+
+    Returns:
+        int: The entry time in seconds since the epoch, or None if it can't be read.
+    """
+
+    if value is None or isinstance(value, (int, float)):
+        return value if value is None else int(value)
+
+    try:
+        return int(datetime.datetime.strptime(value, "%d-%m-%Y.%H:%M:%S").timestamp())
+    except ValueError:
+        try:
+            return int(float(value))
+        except ValueError:
+            return None
+
+
+def legacy_float(value):
+    """
+    Convert a number stored as text to a float.
+
+    Args:
+        value: The stored number.
+
+    Returns:
+        float: The number, or None if it's empty or can't be read.
+    """
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
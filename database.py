@@ -8,14 +8,25 @@ Classes:
     - User: The model representing user data in the database.
     - Url: The model representing URL data in the database.
     - Stat: The model representing statistics data in the database.
+    - Rollup: The model representing per-URL click counters in the database.
+    - ClickBucket: The model representing per-URL hourly click counts in the database.
+    - UniqueSketch: The model representing per-URL unique visitor sketches in the database.
+    - Sequence: The model representing named counters in the database.
+    - Invalidation: The model representing short URLs to drop from every process's resolution caches.
 
 Author: Yousef Saeed
 """
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.util import find_tables
 from os import getcwd, getenv
 from dotenv import load_dotenv
+import datetime
+import sqlite3
 
 load_dotenv()
 
@@ -28,7 +39,160 @@ cwd = getcwd()
 app.config["SECRET_KEY"] = getenv("SECRET_KEY")
 app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{cwd}/{getenv('DB')}.db"
 
-db = SQLAlchemy(app)
+# Clicks and the statistics built from them live in the "clicks" database, so heavy click writes don't block
+# URL lookups. It defaults to the main database; existing clicks are moved by "python migrate.py" once it's set.
+app.config["STATS_DB"] = getenv("STATS_DB", getenv("DB"))
+app.config["SQLALCHEMY_BINDS"] = {
+    "clicks": f"sqlite:///{cwd}/{app.config['STATS_DB']}.db"
+}
+
+# The version of the schema below. Existing databases are upgraded to it with "python migrate.py".
+SCHEMA_VERSION = 10
+
+# Click tracking: "sync" stores each click before redirecting, "async" queues it for background workers.
+app.config["TRACKING_MODE"] = getenv("TRACKING_MODE", "sync")
+app.config["TRACKING_QUEUE_SIZE"] = int(getenv("TRACKING_QUEUE_SIZE", 10000))
+app.config["TRACKING_WORKERS"] = int(getenv("TRACKING_WORKERS", 2))
+app.config["TRACKING_OVERFLOW"] = getenv("TRACKING_OVERFLOW", "drop")
+app.config["TRACKING_BLOCK_TIMEOUT"] = float(getenv("TRACKING_BLOCK_TIMEOUT", 0.05))
+
+# Clicks are written in bulk batches, flushed when full or when the oldest click has waited long enough.
+app.config["STATS_BATCH_SIZE"] = int(getenv("STATS_BATCH_SIZE", 500))
+app.config["STATS_FLUSH_INTERVAL"] = float(getenv("STATS_FLUSH_INTERVAL", 1.0))
+# Clicks kept for retrying while their batches fail to write; beyond it the oldest are dropped.
+app.config["STATS_MAX_PENDING"] = int(getenv("STATS_MAX_PENDING", 50000))
+
+# Unique visitors: "approx" estimates them from HyperLogLog sketches, "exact" counts every distinct IP.
+# Sketches with precision p take 2^p bytes and have a relative standard error of 1.04 / sqrt(2^p).
+app.config["UNIQUE_COUNT"] = getenv("UNIQUE_COUNT", "approx")
+app.config["HLL_PRECISION"] = int(getenv("HLL_PRECISION", 12))
+
+# Bulk deletes remove at most this many rows per transaction, so no single delete holds the write lock for long.
+app.config["DELETE_CHUNK_SIZE"] = int(getenv("DELETE_CHUNK_SIZE", 5000))
+
+# Geolocation: an optional local IP-range database, with the remote DbIpCity service as a fallback.
+app.config["GEO_DB"] = getenv("GEO_DB")
+app.config["GEO_FALLBACK"] = getenv("GEO_FALLBACK", "True").title() == "True"
+app.config["GEO_CACHE_SIZE"] = int(getenv("GEO_CACHE_SIZE", 100000))
+app.config["GEO_CACHE_TTL"] = float(getenv("GEO_CACHE_TTL", 86400))
+# Lookups that failed because a backend couldn't be reached are retried after this many seconds instead.
+app.config["GEO_FAILURE_TTL"] = float(getenv("GEO_FAILURE_TTL", 60))
+app.config["GEO_CACHE_PREFIXES"] = getenv("GEO_CACHE_PREFIXES", "False").title() == "True"
+# The server's public IP, used to measure client distances. If unset, the request's remote address is used.
+app.config["SERVER_IP"] = getenv("SERVER_IP")
+
+# Number of distinct user agents whose parsed platform and browser are kept in memory.
+app.config["UA_CACHE_SIZE"] = int(getenv("UA_CACHE_SIZE", 10000))
+
+# Short URLs are allocated from a shared counter, which each process reserves this many values of at a time.
+# With the "pool" allocator, each process keeps short URLs encoded ahead of time, refilled in the background.
+app.config["SHORT_CODE_ALLOCATOR"] = getenv("SHORT_CODE_ALLOCATOR", "counter")
+app.config["SHORT_CODE_BLOCK_SIZE"] = int(getenv("SHORT_CODE_BLOCK_SIZE", 100))
+app.config["SHORT_CODE_POOL_SIZE"] = int(getenv("SHORT_CODE_POOL_SIZE", 1000))
+app.config["SHORT_CODE_POOL_LOW_WATER"] = int(getenv("SHORT_CODE_POOL_LOW_WATER", 250))
+
+# Shortening a long URL its owner already has an unexpired short URL for returns that short URL instead of a new one.
+app.config["SHORTEN_DEDUP"] = getenv("SHORTEN_DEDUP", "False").title() == "True"
+
+# URLs listed per dashboard page, and the most the API returns per page.
+app.config["DASHBOARD_PAGE_SIZE"] = int(getenv("DASHBOARD_PAGE_SIZE", 20))
+app.config["API_MAX_PAGE_SIZE"] = int(getenv("API_MAX_PAGE_SIZE", 1000))
+
+# Bulk shortening stores this many URLs per transaction.
+app.config["BULK_SHORTEN_CHUNK_SIZE"] = int(getenv("BULK_SHORTEN_CHUNK_SIZE", 1000))
+
+# Short URL resolution cache: resolved long URLs, plus a shorter-lived cache of short URLs that don't exist.
+app.config["RESOLVE_CACHE_SIZE"] = int(getenv("RESOLVE_CACHE_SIZE", 10000))
+app.config["RESOLVE_CACHE_TTL"] = float(getenv("RESOLVE_CACHE_TTL", 300))
+app.config["RESOLVE_MISS_CACHE_SIZE"] = int(getenv("RESOLVE_MISS_CACHE_SIZE", 10000))
+app.config["RESOLVE_MISS_CACHE_TTL"] = float(getenv("RESOLVE_MISS_CACHE_TTL", 30))
+# Each process has its own caches, so deleted and updated short URLs are logged in the database,
+# and every process drops them from its caches within this many seconds.
+app.config["RESOLVE_CACHE_SYNC_INTERVAL"] = float(
+    getenv("RESOLVE_CACHE_SYNC_INTERVAL", 1)
+)
+
+# Expiry scheduler: URLs deleted per batch when reaping, upcoming deadlines loaded at a time, seconds
+# between reloads of the deadlines, which picks up URLs saved by other processes, and the minimum seconds
+# between sweeps. Expired URLs stop resolving right away, so sweeps only reclaim their rows and clicks.
+app.config["EXPIRY_BATCH_SIZE"] = int(getenv("EXPIRY_BATCH_SIZE", 500))
+app.config["EXPIRY_LOAD_SIZE"] = int(getenv("EXPIRY_LOAD_SIZE", 1000))
+app.config["EXPIRY_RESCAN_INTERVAL"] = float(getenv("EXPIRY_RESCAN_INTERVAL", 3600))
+app.config["EXPIRY_SWEEP_INTERVAL"] = float(getenv("EXPIRY_SWEEP_INTERVAL", 300))
+
+# Serving with Gunicorn: the most clicked short URLs resolved before the workers are forked,
+# and the lock file electing the one worker that sweeps expired URLs.
+app.config["WARM_CACHE_SIZE"] = int(getenv("WARM_CACHE_SIZE", 1000))
+app.config["SWEEPER_LOCK"] = getenv("SWEEPER_LOCK", f"{cwd}/{getenv('DB')}.sweeper.lock")
+
+# Storage profile: "throughput" puts SQLite in WAL mode with the pragmas below, so reads don't wait for writers,
+# and pools connections for multi-threaded workers. "default" keeps SQLite's and SQLAlchemy's defaults.
+app.config["DB_PROFILE"] = getenv("DB_PROFILE", "default")
+app.config["SQLITE_SYNCHRONOUS"] = getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+app.config["SQLITE_MMAP_SIZE"] = int(getenv("SQLITE_MMAP_SIZE", 268435456))
+app.config["SQLITE_CACHE_SIZE"] = int(getenv("SQLITE_CACHE_SIZE", -65536))
+app.config["SQLITE_BUSY_TIMEOUT"] = int(getenv("SQLITE_BUSY_TIMEOUT", 5000))
+app.config["DB_POOL_SIZE"] = int(getenv("DB_POOL_SIZE", 16))
+app.config["DB_POOL_OVERFLOW"] = int(getenv("DB_POOL_OVERFLOW", 16))
+app.config["DB_POOL_TIMEOUT"] = float(getenv("DB_POOL_TIMEOUT", 30))
+
+if app.config["DB_PROFILE"] == "throughput":
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": app.config["DB_POOL_SIZE"],
+        "max_overflow": app.config["DB_POOL_OVERFLOW"],
+        "pool_timeout": app.config["DB_POOL_TIMEOUT"],
+    }
+
+
+class BindSession(Session):
+    """
+    BindSession is a session that also sends Core SELECT statements over a bound table to that table's database.
+
+    Flask-SQLAlchemy only routes ORM queries and INSERT, UPDATE, and DELETE statements by bind key,
+    so selecting the columns of a clicks table would otherwise query the main database.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """
+        Select the engine of the first bound table a statement reads from, or defer to Flask-SQLAlchemy.
+        """
+
+        if bind is None and mapper is None and clause is not None:
+            for table in find_tables(clause, include_crud=True):
+                metadata = getattr(table, "metadata", None)
+                if metadata is not None and "bind_key" in metadata.info:
+                    return db.engines[metadata.info["bind_key"]]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={"class_": BindSession})
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(connection, connection_record):
+    """
+    Apply the storage profile's pragmas to every new SQLite connection.
+
+    Args:
+        connection: The DB-API connection.
+        connection_record: The pool's record of the connection.
+
+    Returns:
+        None
+    """
+
+    if app.config["DB_PROFILE"] != "throughput" or not isinstance(
+        connection, sqlite3.Connection
+    ):
+        return
+
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute(f"PRAGMA synchronous = {app.config['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA mmap_size = {app.config['SQLITE_MMAP_SIZE']}")
+    cursor.execute(f"PRAGMA cache_size = {app.config['SQLITE_CACHE_SIZE']}")
+    cursor.execute(f"PRAGMA busy_timeout = {app.config['SQLITE_BUSY_TIMEOUT']}")
+    cursor.close()
 
 
 class User(db.Model):
@@ -56,57 +220,178 @@ class Url(db.Model):
     Attributes:
         short_url (str): Shortened URL identifier.
         long_url (str): Original long URL.
-        creation_date (str): Date and time when the URL was created.
-        expiration_date (str): Date and time when the URL expires (if applicable).
+        url_hash (int): Hash of the normalized long URL, for indexed lookups by long URL.
+        created_at (int): When the URL was created, in seconds since the epoch.
+        creation_date (str): created_at in "%d-%m-%Y.%H:%M:%S" format.
+        expires_at (int): When the URL expires, in seconds since the epoch (if applicable).
+        expiration_date (str): expires_at in "%d-%m-%Y.%H:%M" format.
         is_permanent (bool): Indicates whether the URL is permanent.
         user_id (str): User identifier associated with the URL.
     """
 
     __tablename__ = "urls"
+    # Serves lookups by user and pages through a user's URLs, newest first, without sorting.
+    __table_args__ = (
+        db.Index("ix_urls_user_id_created_at", "user_id", "created_at", "short_url"),
+    )
     short_url = db.Column(db.String(16), primary_key=True)
     long_url = db.Column(db.String(2048))
-    creation_date = db.Column(db.String(19))
-    expiration_date = db.Column(db.String(16))
+    url_hash = db.Column(db.BigInteger, index=True)
+    created_at = db.Column(db.Integer)
+    expires_at = db.Column(db.Integer, index=True)
     is_permanent = db.Column(db.Boolean)
     user_id = db.Column(db.String(36))
 
+    @property
+    def creation_date(self):
+        if self.created_at is None:
+            return None
+        return datetime.datetime.fromtimestamp(self.created_at).strftime("%d-%m-%Y.%H:%M:%S")
+
+    @property
+    def expiration_date(self):
+        if self.expires_at is None:
+            return None
+        return datetime.datetime.fromtimestamp(self.expires_at).strftime("%d-%m-%Y.%H:%M")
+
+    @expiration_date.setter
+    def expiration_date(self, value):
+        self.expires_at = (
+            None
+            if value is None
+            else int(datetime.datetime.strptime(value, "%d-%m-%Y.%H:%M").timestamp())
+        )
+
 
 class Stat(db.Model):
     """
-    Stat model for storing statistics data in the database.
+    Stat model for storing statistics data in the clicks database.
 
     Attributes:
         id (int): Unique statistics entry identifier.
         short_url (str): Shortened URL identifier.
-        entry_time (str): Date and time of user entry.
-        response_time (str): Response time of the server.
+        entry_time (int): Date and time of user entry, in seconds since the epoch.
+        response_time (float): Response time of the server, in seconds.
         platform (str): User's platform (OS).
         browser (str): User's browser and version.
         ip (str): User's IP address.
         city (str): User's city.
         region (str): User's region.
         country (str): User's country.
-        latitude (str): User's latitude.
-        longitude (str): User's longitude.
-        distance (str): Distance between the client and server.
+        latitude (float): User's latitude.
+        longitude (float): User's longitude.
+        distance (float): Distance between the client and server, in kilometers.
     """
 
+    __bind_key__ = "clicks"
     __tablename__ = "stats"
     id = db.Column(db.Integer, primary_key=True)
-    short_url = db.Column(db.String(16))
-    entry_time = db.Column(db.String(19))
-    response_time = db.Column(db.String(6))
+    short_url = db.Column(db.String(16), index=True)
+    entry_time = db.Column(db.Integer)
+    response_time = db.Column(db.Float)
     platform = db.Column(db.String(64))
     browser = db.Column(db.String(64))
     ip = db.Column(db.String(39))
     city = db.Column(db.String(56))
     region = db.Column(db.String(56))
     country = db.Column(db.String(56))
-    latitude = db.Column(db.String(22))
-    longitude = db.Column(db.String(22))
-    distance = db.Column(db.String(22))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    distance = db.Column(db.Float)
+
+
+class Rollup(db.Model):
+    """
+    Rollup model for storing click counters per short URL, kept up to date as clicks are written.
+
+    Attributes:
+        short_url (str): Shortened URL identifier.
+        dimension (str): The counted Stat column (e.g. "browser"), or "clicks" for the total.
+        value (str): The counted value of the column, with NULL stored as "".
+        entries (int): The number of clicks with the value, or with a non-NULL value for summed columns.
+        total (float): The sum of the column's values, for summed columns like response_time.
+    """
+
+    __bind_key__ = "clicks"
+    __tablename__ = "rollups"
+    short_url = db.Column(db.String(16), primary_key=True)
+    dimension = db.Column(db.String(16), primary_key=True)
+    value = db.Column(db.String(64), primary_key=True)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class ClickBucket(db.Model):
+    """
+    ClickBucket model for storing the number of clicks on a short URL per hour, kept up to date as clicks are written.
+
+    Attributes:
+        short_url (str): Shortened URL identifier.
+        bucket (int): The start of the hour, in seconds since the epoch.
+        entries (int): The number of clicks in the hour.
+    """
+
+    __bind_key__ = "clicks"
+    __tablename__ = "click_buckets"
+    short_url = db.Column(db.String(16), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UniqueSketch(db.Model):
+    """
+    UniqueSketch model for storing HyperLogLog sketches of the IPs that clicked a short URL, per day and overall.
+
+    Attributes:
+        short_url (str): Shortened URL identifier.
+        day (int): The start of the day, in seconds since the epoch, or -1 for the sketch of every click.
+        sketch (bytes): The serialized sketch.
+    """
+
+    __bind_key__ = "clicks"
+    __tablename__ = "unique_sketches"
+    short_url = db.Column(db.String(16), primary_key=True)
+    day = db.Column(db.Integer, primary_key=True)
+    sketch = db.Column(db.LargeBinary, nullable=False)
+
+
+class Sequence(db.Model):
+    """
+    Sequence model for storing named counters in the database.
+
+    Attributes:
+        name (str): The counter's name.
+        value (int): The highest value reserved so far.
+    """
+
+    __tablename__ = "sequences"
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Invalidation(db.Model):
+    """
+    Invalidation model for storing the short URLs every process must drop from its resolution caches.
+
+    Attributes:
+        id (int): Increasing identifier, never reused, which each process reads past.
+        short_url (str): The deleted or updated short URL.
+        created_at (int): When the short URL was changed, in seconds since the epoch.
+    """
+
+    __tablename__ = "invalidations"
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = db.Column(db.Integer, primary_key=True)
+    short_url = db.Column(db.String(16), nullable=False)
+    created_at = db.Column(db.Integer, nullable=False)
 
 
 if __name__ == "__main__":
     with app.app_context():
+        is_new = not db.inspect(db.engine).get_table_names()
+        # Builds the tables of both the main and the clicks databases.
         db.create_all()
+        # A freshly built database already has the latest schema; an existing one needs "python migrate.py".
+        if is_new:
+            db.session.execute(db.text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+            db.session.commit()
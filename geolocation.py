@@ -0,0 +1,465 @@
+"""
+Geolocation Module
+
+This module resolves IP addresses to locations (city, region, country, latitude, longitude).
+Lookups go through a chain of backends: a local IP-range database that answers offline with a binary search,
+and optionally the remote DbIpCity service as a fallback.
+Results are cached per IP, or per /24 (IPv4) and /48 (IPv6) network when prefix aggregation is enabled.
+
+The local database is the DB-IP "IP to City Lite" CSV format
+(ip_start, ip_end, continent, country, stateprov, city, latitude, longitude).
+The CSV is compiled once into a compact binary index, which is memory mapped so that every
+worker process shares the same pages instead of loading its own copy:
+
+    python geolocation.py dbip-city-lite.csv geo.idx
+
+Classes:
+    - LocalGeoBackend: Looks up IPs in a local IP-range index.
+    - DbIpCityBackend: Looks up IPs with the remote DbIpCity service.
+    - GeoLocator: Resolves IPs through a chain of backends.
+
+Author: Yousef Saeed
+"""
+
+from ip2geotools.databases.noncommercial import DbIpCity
+from ipaddress import ip_address, ip_network
+from math import isnan
+from mmap import mmap, ACCESS_READ
+from tempfile import NamedTemporaryFile
+import csv
+import os
+import struct
+import sys
+
+from database import *
+from cache import LRUCache
+
+
+MAGIC = b"GEOIDX02"
+HEADER = struct.Struct("<8sII")
+# start ip, end ip, country, region, and city string ids, latitude, longitude (NaN when unknown).
+RECORD = struct.Struct("<16s16sIIIdd")
+OFFSET = struct.Struct("<I")
+
+# IPv4 addresses are stored as IPv4-mapped IPv6 addresses so both families share one index.
+IPV4_MAPPED = 0xFFFF00000000
+
+
+def pack_ip(ip):
+    """
+    Convert an IP address to a 16-byte big-endian key that sorts in address order.
+
+    Args:
+        ip (str): The IPv4 or IPv6 address.
+
+    Returns:
+        bytes: The 16-byte key.
+    """
+
+    address = ip_address(ip.strip())
+    value = int(address)
+    if address.version == 4:
+        value |= IPV4_MAPPED
+    return value.to_bytes(16, "big")
+
+
+def build_index(csv_path):
+    """
+    Compile a DB-IP city CSV file into the binary index format.
+
+    Args:
+        csv_path (str): The path of the CSV file.
+
+    Returns:
+        bytes: The binary index.
+    """
+
+    strings = {"": 0}
+    records = []
+
+    def string_id(value):
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    with open(csv_path, newline="", encoding="utf-8") as file:
+        for row in csv.reader(file):
+            if len(row) < 8:
+                continue
+            start, end, _, country, region, city, latitude, longitude = row[:8]
+            records.append(
+                (
+                    pack_ip(start),
+                    pack_ip(end),
+                    string_id(country),
+                    string_id(region),
+                    string_id(city),
+                    float(latitude or "nan"),
+                    float(longitude or "nan"),
+                )
+            )
+
+    records.sort()
+
+    encoded = [value.encode("utf-8") for value in strings]
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+
+    return b"".join(
+        [
+            HEADER.pack(MAGIC, len(records), len(encoded)),
+            b"".join(RECORD.pack(*record) for record in records),
+            b"".join(OFFSET.pack(offset) for offset in offsets),
+            b"".join(encoded),
+        ]
+    )
+
+
+def read_magic(index_path):
+    """
+    Read the format marker at the start of an index file.
+
+    Args:
+        index_path (str): The path of the index file.
+
+    Returns:
+        bytes: The marker, which is MAGIC for an index in the current format.
+    """
+
+    with open(index_path, "rb") as file:
+        return file.read(len(MAGIC))
+
+
+def compile_index(csv_path, index_path):
+    """
+    Compile a DB-IP city CSV file into a binary index file.
+
+    The file is written to a temporary name and then renamed, so processes building it
+    concurrently never see a partial index.
+
+    Args:
+        csv_path (str): The path of the CSV file.
+        index_path (str): The path of the index file to write.
+
+    Returns:
+        None
+    """
+
+    data = build_index(csv_path)
+    directory = os.path.dirname(os.path.abspath(index_path))
+    with NamedTemporaryFile(dir=directory, delete=False) as file:
+        file.write(data)
+    os.replace(file.name, index_path)
+
+
+class LocalGeoBackend:
+    """
+    LocalGeoBackend is a class for looking up IPs in a local, memory-mapped IP-range index.
+
+    Attributes:
+        path (str): The path of the index file.
+        count (int): The number of IP ranges in the index.
+
+    Methods:
+        - lookup(ip)
+    """
+
+    def __init__(self, path):
+        """
+        Initialize LocalGeoBackend by memory mapping an index file.
+
+        If a CSV file is given, it is compiled into an index file next to it first,
+        unless an up-to-date one in the current format already exists.
+
+        Args:
+            path (str): The path of the index or CSV file.
+        """
+
+        if path.endswith(".csv"):
+            index_path = path[:-4] + ".idx"
+            if (
+                not os.path.exists(index_path)
+                or os.path.getmtime(index_path) < os.path.getmtime(path)
+                or read_magic(index_path) != MAGIC
+            ):
+                compile_index(path, index_path)
+            path = index_path
+
+        self.path = path
+        with open(path, "rb") as file:
+            self._data = mmap(file.fileno(), 0, access=ACCESS_READ)
+
+        magic, self.count, strings_count = HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC:
+            raise ValueError(
+                f"{path} is not a geolocation index in the current format, compile it again."
+            )
+
+        self._offsets_start = HEADER.size + self.count * RECORD.size
+        self._strings_start = self._offsets_start + (strings_count + 1) * OFFSET.size
+        self._strings = {}
+
+    def lookup(self, ip):
+        """
+        Find the location of an IP address with a binary search over the IP ranges.
+
+        Args:
+            ip (str): The IP address to locate.
+
+        Returns:
+            dict: The location details, or None if the IP is not in any range.
+        """
+
+        try:
+            key = pack_ip(ip)
+        except ValueError:
+            return None
+
+        data = self._data
+        low, high = 0, self.count
+        # Find the last range starting at or before the key.
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * RECORD.size
+            if data[offset : offset + 16] <= key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return None
+
+        _, end, country, region, city, latitude, longitude = RECORD.unpack_from(
+            data, HEADER.size + (low - 1) * RECORD.size
+        )
+        if key > end:
+            return None
+
+        # Ranges without coordinates are located by name only, so no distance is measured from them.
+        if isnan(latitude) or isnan(longitude):
+            latitude = longitude = None
+
+        return {
+            "city": self._string(city),
+            "region": self._string(region),
+            "country": self._string(country),
+            "latitude": latitude,
+            "longitude": longitude,
+        }
+
+    def _string(self, string_id):
+        """
+        Decode a string from the index's string table, caching the result.
+        """
+
+        if string_id not in self._strings:
+            start, end = struct.unpack_from(
+                "<II", self._data, self._offsets_start + string_id * OFFSET.size
+            )
+            value = self._data[self._strings_start + start : self._strings_start + end]
+            self._strings[string_id] = value.decode("utf-8") or None
+        return self._strings[string_id]
+
+
+class DbIpCityBackend:
+    """
+    DbIpCityBackend is a class for looking up IPs with the remote DbIpCity service.
+
+    Methods:
+        - lookup(ip)
+    """
+
+    def lookup(self, ip):
+        """
+        Find the location of an IP address with a DbIpCity request.
+
+        Args:
+            ip (str): The IP address to locate.
+
+        Returns:
+            dict: The location details.
+        """
+
+        details = DbIpCity.get(ip)
+        return {
+            "city": details.city,
+            "region": details.region,
+            "country": details.country,
+            "latitude": details.latitude,
+            "longitude": details.longitude,
+        }
+
+
+class GeoLocator:
+    """
+    GeoLocator is a class for resolving IPs through a chain of backends.
+
+    Each backend is tried in order until one finds the IP.
+    A backend that fails (for example, a remote service that can't be reached) is skipped.
+    Lookups no backend could answer because one failed are only remembered briefly, in a separate cache,
+    so a transient outage isn't cached as "unknown location" for as long as real results.
+
+    Attributes:
+        backends (list): The backends to try, in order.
+        cache (LRUCache): The cache of resolved locations, or None to resolve every lookup.
+        failure_cache (LRUCache): The short-lived cache of failed lookups, or None to retry every failed lookup.
+        aggregate_prefixes (bool): Whether IPs in the same /24 (IPv4) or /48 (IPv6) network share a cache entry.
+        server_ip (str): The server's public IP address, or None if it isn't configured.
+        server_location (dict): The location of the server if its IP is configured, resolved at startup
+            and looked up again for as long as it's unknown.
+
+    Methods:
+        - cache_key(ip)
+        - locate(ip)
+        - stats()
+    """
+
+    def __init__(
+        self,
+        backends,
+        cache=None,
+        failure_cache=None,
+        aggregate_prefixes=False,
+        server_ip=None,
+    ):
+        """
+        Initialize GeoLocator with its backends and cache.
+
+        Args:
+            backends (list): The backends to try, in order.
+            cache (LRUCache, optional): The cache of resolved locations.
+            failure_cache (LRUCache, optional): The short-lived cache of failed lookups.
+            aggregate_prefixes (bool, optional): Whether IPs in the same network share a cache entry.
+            server_ip (str, optional): The server's public IP address, resolved here.
+        """
+
+        self.backends = backends
+        self.cache = cache
+        self.failure_cache = failure_cache
+        self.aggregate_prefixes = aggregate_prefixes
+        self.server_ip = server_ip
+        self._server_location = self.locate(server_ip) if server_ip else None
+
+    @property
+    def server_location(self):
+        """
+        The location of the server, or None if its IP isn't configured.
+
+        A lookup that found no coordinates, for example because the remote backend was unreachable at startup,
+        is tried again, through the caches, until one does.
+        """
+
+        if self.server_ip and self._server_location["latitude"] is None:
+            self._server_location = self.locate(self.server_ip)
+        return self._server_location
+
+    def cache_key(self, ip):
+        """
+        Get the cache key of an IP address.
+
+        Args:
+            ip (str): The IP address.
+
+        Returns:
+            str: The IP itself, or its /24 or /48 network if prefix aggregation is enabled.
+        """
+
+        if not self.aggregate_prefixes:
+            return ip
+
+        try:
+            prefix = 24 if ip_address(ip).version == 4 else 48
+        except ValueError:
+            return ip
+        return str(ip_network(f"{ip}/{prefix}", strict=False))
+
+    def locate(self, ip):
+        """
+        Find the location of an IP address, using the cache when possible.
+
+        Args:
+            ip (str): The IP address to locate.
+
+        Returns:
+            dict: The location details, with None values if no backend found the IP.
+        """
+
+        key = self.cache_key(ip)
+        for cache in (self.cache, self.failure_cache):
+            location = cache.get(key) if cache is not None else None
+            if location is not None:
+                return location
+
+        location, failed = self._resolve(ip)
+        cache = self.failure_cache if failed else self.cache
+        if cache is not None:
+            cache.set(key, location)
+        return location
+
+    def stats(self):
+        """
+        Get the hit and miss counters of the location and failed lookup caches.
+
+        Returns:
+            dict: The statistics of each cache, or None for a disabled cache.
+        """
+
+        return {
+            "locations": self.cache.stats() if self.cache is not None else None,
+            "failures": (
+                self.failure_cache.stats() if self.failure_cache is not None else None
+            ),
+        }
+
+    def _resolve(self, ip):
+        """
+        Find the location of an IP address by asking each backend in turn.
+
+        Returns the location, with None values if no backend found the IP,
+        and whether a backend failed before any found it.
+        """
+
+        failed = False
+        for backend in self.backends:
+            try:
+                location = backend.lookup(ip)
+            except Exception:
+                location = None
+                failed = True
+            if location is not None:
+                return location, False
+
+        return {
+            "city": None,
+            "region": None,
+            "country": None,
+            "latitude": None,
+            "longitude": None,
+        }, failed
+
+
+backends = []
+if app.config["GEO_DB"]:
+    backends.append(LocalGeoBackend(app.config["GEO_DB"]))
+if app.config["GEO_FALLBACK"]:
+    backends.append(DbIpCityBackend())
+
+locator = GeoLocator(
+    backends,
+    cache=(
+        LRUCache(app.config["GEO_CACHE_SIZE"], app.config["GEO_CACHE_TTL"])
+        if app.config["GEO_CACHE_SIZE"] > 0
+        else None
+    ),
+    failure_cache=(
+        LRUCache(app.config["GEO_CACHE_SIZE"], app.config["GEO_FAILURE_TTL"])
+        if app.config["GEO_CACHE_SIZE"] > 0 and app.config["GEO_FAILURE_TTL"] > 0
+        else None
+    ),
+    aggregate_prefixes=app.config["GEO_CACHE_PREFIXES"],
+    server_ip=app.config["SERVER_IP"],
+)
+
+
+if __name__ == "__main__":
+    compile_index(sys.argv[1], sys.argv[2])
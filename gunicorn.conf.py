@@ -0,0 +1,69 @@
+"""
+Gunicorn Configuration
+
+This file serves the application in production with a fleet of pre-forked worker processes:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The application is imported and warmed up once in the master process before the workers are forked,
+so they start with compiled templates, a built user agent parser, and the most clicked short URLs already resolved.
+Every worker then stands for election as the expiry sweeper, and only the elected one sweeps.
+On shutdown, workers finish their requests and store their queued clicks before exiting.
+
+Settings are read from the environment (or the .env file):
+    - WEB_BIND: The address to listen on.
+    - WEB_WORKERS: The number of worker processes.
+    - WEB_THREADS: The number of request threads per worker.
+    - WEB_TIMEOUT: Seconds a silent worker is given before it's restarted.
+    - WEB_GRACEFUL_TIMEOUT: Seconds workers are given to finish on shutdown.
+
+Author: Yousef Saeed
+"""
+
+from multiprocessing import cpu_count
+from os import getenv
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = getenv("WEB_BIND", "127.0.0.1:5000")
+workers = int(getenv("WEB_WORKERS", cpu_count() * 2 + 1))
+threads = int(getenv("WEB_THREADS", 4))
+timeout = int(getenv("WEB_TIMEOUT", 30))
+graceful_timeout = int(getenv("WEB_GRACEFUL_TIMEOUT", 30))
+
+# Import the application in the master process, so the workers share its memory and warm caches.
+preload_app = True
+
+
+def when_ready(server):
+    """
+    Warm up the application in the master process, right before the workers are forked.
+    """
+
+    from app import warm_up
+
+    warm = warm_up()
+    server.log.info(
+        f"Warmed up {warm['templates']} templates and {warm['urls']} short URLs"
+    )
+
+
+def post_worker_init(worker):
+    """
+    Stand for election as the expiry sweeper in each new worker.
+    """
+
+    from app import start_sweeper
+
+    start_sweeper()
+
+
+def worker_exit(server, worker):
+    """
+    Store the clicks still queued or buffered in a worker before it exits.
+    """
+
+    from app import shut_down
+
+    shut_down()
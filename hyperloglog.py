@@ -0,0 +1,195 @@
+"""
+HyperLogLog Module
+
+This module estimates the number of distinct values in a set using a HyperLogLog sketch,
+in constant memory and with a relative standard error of about 1.04 / sqrt(2^precision).
+Sketches of different sets can be merged into the sketch of their union, and serialized compactly for storage.
+A sketch can be folded into the exact sketch of the same values at a lower precision, so sketches of different
+precisions can be merged once folded to the lowest.
+
+Functions:
+    - standard_error(precision): The relative standard error of sketches with a given precision.
+
+Classes:
+    - HyperLogLog: A mergeable sketch for estimating the number of distinct values.
+
+Author: Yousef Saeed
+"""
+
+from hashlib import blake2b
+from math import log, sqrt
+import zlib
+
+
+def standard_error(precision):
+    """
+    Get the relative standard error of the estimates of sketches with a given precision.
+
+    Args:
+        precision (int): The number of bits of each hash used to pick a register.
+
+    Returns:
+        float: The relative standard error.
+    """
+
+    return 1.04 / sqrt(1 << precision)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog is a class for estimating the number of distinct values added to it.
+
+    Attributes:
+        precision (int): The number of bits of each hash used to pick a register, from 4 to 16.
+        registers (bytearray): The highest rank seen by each of the 2^precision registers.
+
+    Methods:
+        - add(value)
+        - update(values)
+        - merge(other)
+        - fold(precision)
+        - count()
+        - to_bytes()
+        - from_bytes(data)
+    """
+
+    def __init__(self, precision=12, registers=None):
+        """
+        Initialize HyperLogLog with empty registers.
+
+        Args:
+            precision (int, optional): The number of bits of each hash used to pick a register, from 4 to 16.
+            registers (bytearray, optional): The registers to start from.
+        """
+
+        if not 4 <= precision <= 16:
+            raise ValueError("The precision must be between 4 and 16.")
+
+        self.precision = precision
+        self.registers = (
+            bytearray(1 << precision) if registers is None else bytearray(registers)
+        )
+
+    def add(self, value):
+        """
+        Add a value to the sketch.
+
+        Args:
+            value (str): The value.
+
+        Returns:
+            None
+        """
+
+        hashed = int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), "big")
+        width = 64 - self.precision
+        index = hashed >> width
+        # The rank is the position of the first 1 bit in the hash bits left after picking the register.
+        rank = width - (hashed & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        """
+        Add several values to the sketch.
+
+        Args:
+            values (iterable): The values.
+
+        Returns:
+            None
+        """
+
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """
+        Merge another sketch into this one, so it estimates the number of distinct values added to either.
+
+        Args:
+            other (HyperLogLog): A sketch with the same precision.
+
+        Returns:
+            HyperLogLog: This sketch.
+        """
+
+        if other.precision != self.precision:
+            raise ValueError("Only sketches with the same precision can be merged.")
+
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def fold(self, precision):
+        """
+        Get the sketch these values would have made at a lower precision.
+
+        The index bits dropped from each register's hash become the leading bits of its rank,
+        so the folded sketch is exactly the one adding the same values at the lower precision gives.
+
+        Args:
+            precision (int): The lower precision, from 4 to this sketch's precision.
+
+        Returns:
+            HyperLogLog: The folded sketch, or this sketch if the precision is the same.
+        """
+
+        if precision == self.precision:
+            return self
+        if not 4 <= precision < self.precision:
+            raise ValueError("A sketch can only be folded to a lower precision.")
+
+        dropped = self.precision - precision
+        folded = HyperLogLog(precision)
+        for index, rank in enumerate(self.registers):
+            if not rank:
+                continue
+            low_bits = index & ((1 << dropped) - 1)
+            rank = dropped - low_bits.bit_length() + 1 if low_bits else dropped + rank
+            target = index >> dropped
+            if rank > folded.registers[target]:
+                folded.registers[target] = rank
+        return folded
+
+    def count(self):
+        """
+        Estimate the number of distinct values added to the sketch.
+
+        Returns:
+            int: The estimated number of distinct values.
+        """
+
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0 ** -rank for rank in self.registers)
+
+        # Small sets are estimated more accurately from the number of empty registers.
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * size and empty:
+            estimate = size * log(size / empty)
+        return round(estimate)
+
+    def to_bytes(self):
+        """
+        Serialize the sketch's registers, compressed.
+
+        Returns:
+            bytes: The serialized sketch.
+        """
+
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Deserialize a sketch serialized by to_bytes().
+
+        Args:
+            data (bytes): The serialized sketch.
+
+        Returns:
+            HyperLogLog: The sketch, with the precision it was serialized with.
+        """
+
+        registers = zlib.decompress(data)
+        return cls(len(registers).bit_length() - 1, registers)
@@ -0,0 +1,109 @@
+"""
+Leader Election Module
+
+This module elects a single leader among the processes serving the application, so background work
+like the expiry sweep runs once however many workers are started.
+Every candidate takes an exclusive lock on the same lock file; the operating system grants it to one process at a time
+and releases it when that process exits, even if it crashes, so a waiting candidate takes over.
+
+Locks are taken on a file descriptor each process opens itself, so the lock must be acquired after forking.
+
+Classes:
+    - LeaderLock: An exclusive, process-wide lock on a lock file.
+
+Author: Yousef Saeed
+"""
+
+from os import getpid
+import fcntl
+
+
+class LeaderLock:
+    """
+    LeaderLock is a class for electing one leader among processes sharing a lock file.
+
+    Attributes:
+        path (str): The path of the lock file.
+
+    Methods:
+        - try_acquire()
+        - acquire()
+        - release()
+        - is_leader()
+    """
+
+    def __init__(self, path):
+        """
+        Initialize LeaderLock with the path of its lock file.
+
+        Args:
+            path (str): The path of the lock file, created if it doesn't exist.
+        """
+
+        self.path = path
+        self._file = None
+
+    def try_acquire(self):
+        """
+        Become the leader if no other process is.
+
+        Returns:
+            bool: True if this process holds the lock, False otherwise.
+        """
+
+        return self._lock(fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def acquire(self):
+        """
+        Wait until this process becomes the leader.
+
+        Returns:
+            None
+        """
+
+        self._lock(fcntl.LOCK_EX)
+
+    def release(self):
+        """
+        Stop being the leader, letting a waiting process take over.
+
+        Returns:
+            None
+        """
+
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def is_leader(self):
+        """
+        Check whether this process holds the lock.
+
+        Returns:
+            bool: True if this process holds the lock, False otherwise.
+        """
+
+        return self._file is not None
+
+    def _lock(self, operation):
+        """
+        Open the lock file and lock it with a flock() operation.
+        """
+
+        if self._file is not None:
+            return True
+
+        lock_file = open(self.path, "a+")
+        try:
+            fcntl.flock(lock_file, operation)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        # Record the leader's PID in the lock file, to make it easy to find.
+        lock_file.truncate(0)
+        lock_file.write(f"{getpid()}\n")
+        lock_file.flush()
+        self._file = lock_file
+        return True
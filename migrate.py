@@ -0,0 +1,462 @@
+"""
+Database Migration Script
+
+This script upgrades an existing database to the current schema in place.
+The schema version is kept in SQLite's user_version pragma, and each migration below upgrades it by one.
+Tables are converted in chunks, so even very large tables are never loaded into memory at once,
+and an interrupted migration picks up where it left off when run again.
+
+Migrations that add click statistics return True, and the statistics are then built from the existing clicks
+once every migration has run (if that is interrupted, "python rollups.py" finishes it).
+Whatever the version, click tables still in the main database are moved once a separate clicks database
+(STATS_DB) is configured.
+
+Usage:
+    python migrate.py
+
+Author: Yousef Saeed
+"""
+
+import datetime
+import re
+
+from database import *
+from converters import legacy_epoch, legacy_float
+
+
+CHUNK_SIZE = 10000
+
+# The tables that live in the clicks database.
+CLICK_TABLES = ["stats", "rollups", "click_buckets", "unique_sketches"]
+
+
+def legacy_expiration(value):
+    """
+    Convert an expiration date stored in the legacy "%d-%m-%Y.%H:%M" format to seconds since the epoch.
+
+    Args:
+        value (str): The stored expiration date.
+
+    Returns:
+        int: The expiration date in seconds since the epoch, or None if it can't be read.
+    """
+
+    try:
+        return int(datetime.datetime.strptime(value, "%d-%m-%Y.%H:%M").timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def separate_clicks_database():
+    """
+    Check whether the clicks database is a different file from the main database.
+
+    Returns:
+        bool: True if clicks are stored separately, False otherwise.
+    """
+
+    return db.engines["clicks"].url.database != db.engine.url.database
+
+
+def copy_in_chunks(connection, source, table, convert):
+    """
+    Copy every row of a table into another, converting each row, one chunk at a time.
+
+    Rows are copied in primary key order, starting after the last row already copied,
+    so an interrupted copy resumes instead of starting over.
+
+    Args:
+        connection (Connection): The database connection.
+        source (str): The name of the table to copy from.
+        table (Table): The table to copy into.
+        convert (function): Converts a source row mapping into the new row's column values.
+
+    Returns:
+        int: The number of rows copied.
+    """
+
+    last_id = connection.execute(db.select(db.func.max(table.c.id))).scalar() or 0
+    copied = 0
+    while True:
+        rows = connection.exec_driver_sql(
+            f"SELECT * FROM {source} WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, CHUNK_SIZE),
+        ).mappings().all()
+        if not rows:
+            return copied
+
+        connection.execute(table.insert(), [convert(row) for row in rows])
+        connection.commit()
+        last_id = rows[-1]["id"]
+        copied += len(rows)
+        print(f"  {table.name}: {copied} rows copied")
+
+
+def migrate_1(connection):
+    """
+    Store click times as integer epochs and click metrics as real numbers, and add indexes for the hot queries.
+    """
+
+    tables = db.inspect(connection).get_table_names()
+    if "stats_legacy" not in tables:
+        connection.exec_driver_sql("ALTER TABLE stats RENAME TO stats_legacy")
+        Stat.__table__.create(connection)
+        connection.commit()
+
+    def convert(row):
+        return {
+            "id": row["id"],
+            "short_url": row["short_url"],
+            "entry_time": legacy_epoch(row["entry_time"]),
+            "response_time": legacy_float(row["response_time"]),
+            "platform": row["platform"],
+            "browser": row["browser"],
+            "ip": row["ip"],
+            "city": row["city"],
+            "region": row["region"],
+            "country": row["country"],
+            "latitude": legacy_float(row["latitude"]),
+            "longitude": legacy_float(row["longitude"]),
+            "distance": legacy_float(row["distance"]),
+        }
+
+    copy_in_chunks(connection, "stats_legacy", Stat.__table__, convert)
+    connection.exec_driver_sql("DROP TABLE stats_legacy")
+
+    for column in ["long_url", "expiration_date", "user_id"]:
+        connection.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS ix_urls_{column} ON urls ({column})"
+        )
+
+
+def migrate_2(connection):
+    """
+    Store expiration dates as integer epochs, which sort chronologically and can use an index.
+    """
+
+    columns = [column["name"] for column in db.inspect(connection).get_columns("urls")]
+    if "expires_at" not in columns:
+        connection.exec_driver_sql("ALTER TABLE urls ADD COLUMN expires_at INTEGER")
+        connection.commit()
+
+    # Walk the table in primary key order, converting one chunk of expiration dates at a time.
+    last_short_url = ""
+    converted = 0
+    while True:
+        rows = connection.exec_driver_sql(
+            "SELECT short_url, expiration_date FROM urls "
+            "WHERE short_url > ? AND expiration_date IS NOT NULL AND expires_at IS NULL "
+            "ORDER BY short_url LIMIT ?",
+            (last_short_url, CHUNK_SIZE),
+        ).all()
+        if not rows:
+            break
+
+        connection.exec_driver_sql(
+            "UPDATE urls SET expires_at = ? WHERE short_url = ?",
+            [
+                (legacy_expiration(expiration_date), short_url)
+                for short_url, expiration_date in rows
+            ],
+        )
+        connection.commit()
+        last_short_url = rows[-1][0]
+        converted += len(rows)
+        print(f"  urls: {converted} expiration dates converted")
+
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_urls_expiration_date")
+    connection.exec_driver_sql("ALTER TABLE urls DROP COLUMN expiration_date")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_urls_expires_at ON urls (expires_at)"
+    )
+
+
+def migrate_3(connection):
+    """
+    Add the sequences table that short URLs are allocated from.
+    """
+
+    Sequence.__table__.create(connection, checkfirst=True)
+
+
+def migrate_4(connection):
+    """
+    Look up long URLs by an indexed hash of the normalized URL instead of the URL itself.
+    """
+
+    from shortener import hash_url
+
+    columns = [column["name"] for column in db.inspect(connection).get_columns("urls")]
+    if "url_hash" not in columns:
+        connection.exec_driver_sql("ALTER TABLE urls ADD COLUMN url_hash BIGINT")
+        connection.commit()
+
+    # Walk the table in primary key order, hashing one chunk of long URLs at a time.
+    last_short_url = ""
+    hashed = 0
+    while True:
+        rows = connection.exec_driver_sql(
+            "SELECT short_url, long_url FROM urls "
+            "WHERE short_url > ? AND url_hash IS NULL "
+            "ORDER BY short_url LIMIT ?",
+            (last_short_url, CHUNK_SIZE),
+        ).all()
+        if not rows:
+            break
+
+        connection.exec_driver_sql(
+            "UPDATE urls SET url_hash = ? WHERE short_url = ?",
+            [(hash_url(long_url or ""), short_url) for short_url, long_url in rows],
+        )
+        connection.commit()
+        last_short_url = rows[-1][0]
+        hashed += len(rows)
+        print(f"  urls: {hashed} long URLs hashed")
+
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_urls_long_url")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_urls_url_hash ON urls (url_hash)"
+    )
+
+
+def migrate_5(connection):
+    """
+    Store creation dates as integer epochs, indexed per user so URL listings can be paginated newest first.
+    """
+
+    columns = [column["name"] for column in db.inspect(connection).get_columns("urls")]
+    if "created_at" not in columns:
+        connection.exec_driver_sql("ALTER TABLE urls ADD COLUMN created_at INTEGER")
+        connection.commit()
+
+    # Walk the table in primary key order, converting one chunk of creation dates at a time.
+    last_short_url = ""
+    converted = 0
+    while True:
+        rows = connection.exec_driver_sql(
+            "SELECT short_url, creation_date FROM urls "
+            "WHERE short_url > ? AND created_at IS NULL "
+            "ORDER BY short_url LIMIT ?",
+            (last_short_url, CHUNK_SIZE),
+        ).all()
+        if not rows:
+            break
+
+        # Unreadable creation dates sort as the oldest URLs rather than dropping out of listings.
+        connection.exec_driver_sql(
+            "UPDATE urls SET created_at = ? WHERE short_url = ?",
+            [
+                (legacy_epoch(creation_date) or 0, short_url)
+                for short_url, creation_date in rows
+            ],
+        )
+        connection.commit()
+        last_short_url = rows[-1][0]
+        converted += len(rows)
+        print(f"  urls: {converted} creation dates converted")
+
+    connection.exec_driver_sql("ALTER TABLE urls DROP COLUMN creation_date")
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_urls_user_id")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_urls_user_id_created_at "
+        "ON urls (user_id, created_at, short_url)"
+    )
+
+
+def migrate_6(connection):
+    """
+    Add per-URL click counters, built from the existing clicks.
+    """
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS rollups ("
+        "short_url VARCHAR(16) NOT NULL, "
+        "dimension VARCHAR(16) NOT NULL, "
+        "value VARCHAR(64) NOT NULL, "
+        "entries INTEGER NOT NULL, "
+        "total FLOAT NOT NULL, "
+        "PRIMARY KEY (short_url, dimension, value))"
+    )
+    connection.commit()
+    return True
+
+
+def migrate_7(connection):
+    """
+    Add per-URL hourly click counts, built from the existing clicks.
+    """
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS click_buckets ("
+        "short_url VARCHAR(16) NOT NULL, "
+        "bucket INTEGER NOT NULL, "
+        "entries INTEGER NOT NULL, "
+        "PRIMARY KEY (short_url, bucket))"
+    )
+    connection.commit()
+    return True
+
+
+def migrate_8(connection):
+    """
+    Add per-URL HyperLogLog sketches of unique visitors, built from the existing clicks.
+    """
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS unique_sketches ("
+        "short_url VARCHAR(16) NOT NULL, "
+        "day INTEGER NOT NULL, "
+        "sketch BLOB NOT NULL, "
+        "PRIMARY KEY (short_url, day))"
+    )
+    connection.commit()
+    return True
+
+
+def move_click_tables(connection):
+    """
+    Move the click tables left in the main database, and their rows, to the clicks database.
+
+    This runs whenever the clicks database is configured separately (STATS_DB), whatever the schema version,
+    so setting STATS_DB on an up-to-date database and running "python migrate.py" moves its clicks.
+    Tables are recreated as they are, rows are copied one chunk per transaction, and a rerun skips the rows
+    already copied.
+
+    Args:
+        connection (Connection): The connection to the main database.
+
+    Returns:
+        int: The number of tables moved.
+    """
+
+    moved = 0
+    connection.exec_driver_sql(
+        "ATTACH DATABASE ? AS clicks", (db.engines["clicks"].url.database,)
+    )
+    for table in CLICK_TABLES:
+        schema = connection.exec_driver_sql(
+            "SELECT sql FROM main.sqlite_master "
+            "WHERE tbl_name = ? AND sql IS NOT NULL ORDER BY type DESC",
+            (table,),
+        ).scalars().all()
+        if not schema:
+            continue
+
+        print(f"Moving {table} to the clicks database")
+        # Recreate the table and its indexes as they are, in the clicks database.
+        for sql in schema:
+            connection.exec_driver_sql(
+                re.sub(
+                    r"^CREATE (UNIQUE )?(TABLE|INDEX) (IF NOT EXISTS )?\"?(\w+)\"?",
+                    lambda match: f"CREATE {match[1] or ''}{match[2]} IF NOT EXISTS clicks.{match[4]}",
+                    sql,
+                    flags=re.IGNORECASE,
+                )
+            )
+        connection.commit()
+
+        # Copy the rows in rowid order, one chunk per transaction; a rerun skips the rows already copied.
+        last_rowid = 0
+        copied = 0
+        while True:
+            rowids = connection.exec_driver_sql(
+                f"SELECT rowid FROM main.{table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, CHUNK_SIZE),
+            ).scalars().all()
+            if not rowids:
+                break
+            connection.exec_driver_sql(
+                f"INSERT OR IGNORE INTO clicks.{table} "
+                f"SELECT * FROM main.{table} WHERE rowid BETWEEN ? AND ?",
+                (rowids[0], rowids[-1]),
+            )
+            connection.commit()
+            last_rowid = rowids[-1]
+            copied += len(rowids)
+            print(f"  {table}: {copied} rows moved")
+
+        connection.exec_driver_sql(f"DROP TABLE main.{table}")
+        connection.commit()
+        moved += 1
+
+    connection.exec_driver_sql("DETACH DATABASE clicks")
+    return moved
+
+
+def migrate_9(connection):
+    """
+    Move clicks and their statistics to the clicks database, if it's configured separately (STATS_DB).
+    """
+
+    if separate_clicks_database():
+        move_click_tables(connection)
+    return False
+
+
+def migrate_10(connection):
+    """
+    Add the log of short URLs to drop from every process's resolution caches.
+    """
+
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS invalidations ("
+        "id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, "
+        "short_url VARCHAR(16) NOT NULL, "
+        "created_at INTEGER NOT NULL)"
+    )
+    connection.commit()
+    return False
+
+
+# Each migration upgrades the schema from the version before it, starting at version 0.
+MIGRATIONS = [
+    migrate_1,
+    migrate_2,
+    migrate_3,
+    migrate_4,
+    migrate_5,
+    migrate_6,
+    migrate_7,
+    migrate_8,
+    migrate_9,
+    migrate_10,
+]
+
+
+def migrate():
+    """
+    Apply every migration the database hasn't had yet.
+
+    Returns:
+        None
+    """
+
+    assert len(MIGRATIONS) == SCHEMA_VERSION
+
+    with db.engine.connect() as connection:
+        version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+        rebuild = False
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            print(f"Migrating to version {number}: {migration.__doc__.strip()}")
+            rebuild = migration(connection) or rebuild
+            connection.exec_driver_sql(f"PRAGMA user_version = {number}")
+            connection.commit()
+
+        # STATS_DB may have been set after the database reached the latest schema, so this doesn't depend on it.
+        if separate_clicks_database():
+            move_click_tables(connection)
+
+    # A new clicks database gets the click tables the main database didn't have to give it.
+    if separate_clicks_database():
+        db.create_all(bind_key="clicks")
+
+    # The statistics are built once all their tables exist, in whichever database holds the clicks.
+    if rebuild:
+        from rollups import rebuild_all
+
+        print(f"Building click statistics: {rebuild_all()} short URLs counted")
+
+    print(f"The database is up to date (version {SCHEMA_VERSION}).")
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate()
@@ -0,0 +1,552 @@
+"""
+Click Rollup Module
+
+This module keeps per-URL click counters in the rollups table, per-URL hourly click counts in the
+click_buckets table, and per-URL HyperLogLog sketches of visitor IPs in the unique_sketches table,
+so statistics are read from a handful of precomputed rows instead of being recomputed from every raw click.
+
+The Stat writer folds each batch of clicks into counter increments and upserts them in the same transaction
+as the clicks themselves, so the counters never drift from the stats table. If they ever do (e.g. after clicks
+were inserted by hand), they can be recomputed from the raw clicks:
+
+    python rollups.py [short_url ...]
+
+Functions:
+    - fold(rows): Fold Stat rows into counter increments.
+    - fold_buckets(rows): Fold Stat rows into hourly click count increments.
+    - add_clicks(rows): Add Stat rows to the counters.
+    - load(short_urls): Read the counters of short URLs.
+    - time_series(short_url, interval=3600, since=None, until=None): Count a short URL's clicks per time interval.
+    - unique_visitors(short_url, since=None, until=None): Count a short URL's unique visitors in a time range.
+    - rebuild(short_urls): Recompute the counters of short URLs from their raw clicks.
+    - rebuild_all(chunk_size=500): Recompute every counter from the raw clicks.
+
+Author: Yousef Saeed
+"""
+
+from collections import Counter, defaultdict
+from math import fsum
+from sqlalchemy import select, func, literal
+from sqlalchemy.dialects.sqlite import insert
+import sys
+
+from database import *
+from hyperloglog import HyperLogLog
+
+
+# Columns whose values are counted, and columns whose values are summed for averages.
+COUNTED = ("platform", "browser", "country", "region", "city", "ip")
+SUMMED = ("response_time", "distance")
+
+# The width of a click bucket, and of the period covered by a daily sketch, in seconds.
+BUCKET_SIZE = 3600
+SKETCH_PERIOD = 86400
+
+# The day of the sketch of every click on a short URL.
+ALL_TIME = -1
+
+
+def fold(rows):
+    """
+    Fold Stat rows into one counter increment per short URL, dimension, and value.
+
+    Args:
+        rows (list): The Stat column values, one dict per row.
+
+    Returns:
+        list: The increments, as Rollup column values.
+    """
+
+    entries = Counter()
+    totals = {}
+    for row in rows:
+        short_url = row["short_url"]
+        entries[short_url, "clicks", ""] += 1
+        for dimension in COUNTED:
+            value = row.get(dimension)
+            entries[short_url, dimension, "" if value is None else value] += 1
+        for dimension in SUMMED:
+            value = row.get(dimension)
+            if value is not None:
+                entries[short_url, dimension, ""] += 1
+                totals.setdefault((short_url, dimension, ""), []).append(value)
+
+    return [
+        {
+            "short_url": short_url,
+            "dimension": dimension,
+            "value": value,
+            "entries": count,
+            "total": fsum(totals.get((short_url, dimension, value), ())),
+        }
+        for (short_url, dimension, value), count in entries.items()
+    ]
+
+
+def fold_buckets(rows):
+    """
+    Fold Stat rows into one hourly click count increment per short URL and hour.
+
+    Args:
+        rows (list): The Stat column values, one dict per row.
+
+    Returns:
+        list: The increments, as ClickBucket column values.
+    """
+
+    entries = Counter(
+        (row["short_url"], row["entry_time"] // BUCKET_SIZE * BUCKET_SIZE)
+        for row in rows
+        if row.get("entry_time") is not None
+    )
+    return [
+        {"short_url": short_url, "bucket": bucket, "entries": count}
+        for (short_url, bucket), count in entries.items()
+    ]
+
+
+def _sketch_ips(rows):
+    """
+    Group the IPs of Stat rows by the sketches they belong in, with NULL IPs as "".
+    """
+
+    ips = defaultdict(set)
+    for row in rows:
+        ip = row.get("ip") or ""
+        ips[row["short_url"], ALL_TIME].add(ip)
+        if row.get("entry_time") is not None:
+            day = row["entry_time"] // SKETCH_PERIOD * SKETCH_PERIOD
+            ips[row["short_url"], day].add(ip)
+    return ips
+
+
+def _add_sketches(rows):
+    """
+    Add the IPs of Stat rows to their URLs' daily and overall sketches, in the caller's transaction.
+    """
+
+    ips = _sketch_ips(rows)
+    columns = UniqueSketch.__table__.c
+    keys = list(ips)
+
+    # Each key takes two bound parameters, so stay well below SQLite's limit.
+    sketches = {}
+    for start in range(0, len(keys), 250):
+        for short_url, day, sketch in db.session.execute(
+            select(columns.short_url, columns.day, columns.sketch).where(
+                db.tuple_(columns.short_url, columns.day).in_(keys[start : start + 250])
+            )
+        ):
+            sketches[short_url, day] = HyperLogLog.from_bytes(sketch)
+
+    values = []
+    for key, key_ips in ips.items():
+        sketch = sketches.get(key) or HyperLogLog(app.config["HLL_PRECISION"])
+        # Sketches stored before HLL_PRECISION was lowered are folded to it; ones stored before it was raised
+        # keep their precision until "python rollups.py" rebuilds them.
+        if sketch.precision > app.config["HLL_PRECISION"]:
+            sketch = sketch.fold(app.config["HLL_PRECISION"])
+        sketch.update(key_ips)
+        values.append(
+            {"short_url": key[0], "day": key[1], "sketch": sketch.to_bytes()}
+        )
+
+    upsert = insert(UniqueSketch)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=["short_url", "day"],
+        set_={"sketch": upsert.excluded.sketch},
+    )
+    db.session.execute(upsert, values)
+
+
+def add_clicks(rows):
+    """
+    Add Stat rows to the counters, hourly click counts, and unique visitor sketches, in the caller's transaction.
+
+    The sketches are read, updated, and written back, so this must run after the caller's transaction has taken
+    the database's write lock (e.g. by inserting the rows), or concurrent writers could overwrite each other's updates.
+
+    Args:
+        rows (list): The Stat column values, one dict per row.
+
+    Returns:
+        None
+    """
+
+    increments = fold(rows)
+    if increments:
+        upsert = insert(Rollup)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=["short_url", "dimension", "value"],
+            set_={
+                "entries": Rollup.entries + upsert.excluded.entries,
+                "total": Rollup.total + upsert.excluded.total,
+            },
+        )
+        db.session.execute(upsert, increments)
+
+    increments = fold_buckets(rows)
+    if increments:
+        upsert = insert(ClickBucket)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=["short_url", "bucket"],
+            set_={"entries": ClickBucket.entries + upsert.excluded.entries},
+        )
+        db.session.execute(upsert, increments)
+
+    if rows:
+        _add_sketches(rows)
+
+
+def load(short_urls):
+    """
+    Read the counters of short URLs.
+
+    Reading them costs one row per distinct value, however many clicks there are.
+    Unique visitors are estimated from a single sketch per URL when UNIQUE_COUNT is "approx",
+    and counted from one counter row per distinct IP otherwise.
+
+    Args:
+        short_urls (list): The short URLs.
+
+    Returns:
+        dict: For each short URL, the number of clicks ("clicks"), of unique IPs ("unique"),
+            a Counter of values per counted column (with NULL as None), (entries, total) per summed column,
+            and a Counter of clicks per hour ("buckets"), keyed by the start of the hour.
+    """
+
+    columns = Rollup.__table__.c
+    buckets = ClickBucket.__table__.c
+    short_urls = list(short_urls)
+    counters = {
+        short_url: {
+            "clicks": 0,
+            "unique": 0,
+            **{dimension: Counter() for dimension in COUNTED if dimension != "ip"},
+            **{dimension: (0, 0.0) for dimension in SUMMED},
+            "buckets": Counter(),
+        }
+        for short_url in short_urls
+    }
+
+    # Stay well below SQLite's limit on the number of bound parameters per query.
+    for start in range(0, len(short_urls), 500):
+        in_chunk = columns.short_url.in_(short_urls[start : start + 500])
+
+        for short_url, dimension, value, entries, total in db.session.execute(
+            select(
+                columns.short_url,
+                columns.dimension,
+                columns.value,
+                columns.entries,
+                columns.total,
+            ).where(
+                in_chunk,
+                # Listing the dimensions lets the primary key skip the many per-IP rows.
+                columns.dimension.in_(
+                    ["clicks", *SUMMED, *(name for name in COUNTED if name != "ip")]
+                ),
+            )
+        ):
+            counter = counters[short_url]
+            if dimension == "clicks":
+                counter["clicks"] = entries
+            elif dimension in SUMMED:
+                counter[dimension] = (entries, total)
+            else:
+                counter[dimension][value or None] = entries
+
+        if app.config["UNIQUE_COUNT"] == "approx":
+            sketches = UniqueSketch.__table__.c
+            for short_url, sketch in db.session.execute(
+                select(sketches.short_url, sketches.sketch).where(
+                    sketches.short_url.in_(short_urls[start : start + 500]),
+                    sketches.day == ALL_TIME,
+                )
+            ):
+                counters[short_url]["unique"] = HyperLogLog.from_bytes(sketch).count()
+        else:
+            # Only the number of distinct IPs is needed, not the IPs themselves.
+            for short_url, unique in db.session.execute(
+                select(columns.short_url, func.count())
+                .where(in_chunk, columns.dimension == "ip")
+                .group_by(columns.short_url)
+            ):
+                counters[short_url]["unique"] = unique
+
+        for short_url, bucket, entries in db.session.execute(
+            select(buckets.short_url, buckets.bucket, buckets.entries)
+            .where(buckets.short_url.in_(short_urls[start : start + 500]))
+            .order_by(buckets.short_url, buckets.bucket)
+        ):
+            counters[short_url]["buckets"][bucket] = entries
+
+    return counters
+
+
+def time_series(short_url, interval=3600, since=None, until=None):
+    """
+    Count the clicks on a short URL per time interval, from its hourly click counts.
+
+    Args:
+        short_url (str): The short URL.
+        interval (int, optional): The length of each interval in seconds, a multiple of an hour.
+        since (int, optional): Only count clicks at or after this time, in seconds since the epoch.
+        until (int, optional): Only count clicks before this time, in seconds since the epoch.
+
+    Returns:
+        list: (start, entries) for each interval with clicks, oldest first, with the start in seconds since the epoch.
+    """
+
+    columns = ClickBucket.__table__.c
+    start = columns.bucket // interval * interval
+    query = (
+        select(start, func.sum(columns.entries))
+        .where(columns.short_url == short_url)
+        .group_by(start)
+        .order_by(start)
+    )
+    # Partially covered hours at either end are left out, as their clicks can't be split.
+    if since is not None:
+        query = query.where(columns.bucket >= since)
+    if until is not None:
+        query = query.where(columns.bucket + BUCKET_SIZE <= until)
+    return [tuple(row) for row in db.session.execute(query)]
+
+
+def unique_visitors(short_url, since=None, until=None):
+    """
+    Count the unique visitors (unique IPs) of a short URL, optionally within a time range.
+
+    When UNIQUE_COUNT is "approx", the estimate merges the daily sketches of the UTC days the range fully covers.
+    Otherwise the distinct IPs of the raw clicks in the range are counted.
+
+    Args:
+        short_url (str): The short URL.
+        since (int, optional): Only count clicks at or after this time, in seconds since the epoch.
+        until (int, optional): Only count clicks before this time, in seconds since the epoch.
+
+    Returns:
+        int: The number of unique visitors.
+    """
+
+    if app.config["UNIQUE_COUNT"] != "approx":
+        columns = Stat.__table__.c
+        query = select(
+            func.count(func.distinct(func.coalesce(columns.ip, "")))
+        ).where(columns.short_url == short_url)
+        if since is not None:
+            query = query.where(columns.entry_time >= since)
+        if until is not None:
+            query = query.where(columns.entry_time < until)
+        return db.session.execute(query).scalar()
+
+    columns = UniqueSketch.__table__.c
+    query = select(columns.sketch).where(columns.short_url == short_url)
+    if since is None and until is None:
+        query = query.where(columns.day == ALL_TIME)
+    else:
+        query = query.where(columns.day != ALL_TIME)
+        if since is not None:
+            query = query.where(columns.day >= since)
+        if until is not None:
+            query = query.where(columns.day + SKETCH_PERIOD <= until)
+
+    # Sketches stored with different HLL_PRECISION settings are merged at the lowest precision among them.
+    sketches = [
+        HyperLogLog.from_bytes(sketch) for sketch in db.session.execute(query).scalars()
+    ]
+    if not sketches:
+        return 0
+    precision = min(sketch.precision for sketch in sketches)
+    merged = HyperLogLog(precision)
+    for sketch in sketches:
+        merged.merge(sketch.fold(precision))
+    return merged.count()
+
+
+def _aggregates(where):
+    """
+    Build the queries that compute every counter from the raw clicks matching a condition.
+    """
+
+    columns = Stat.__table__.c
+    queries = [
+        select(
+            columns.short_url,
+            literal("clicks"),
+            literal(""),
+            func.count(),
+            literal(0.0),
+        )
+        .where(where)
+        .group_by(columns.short_url)
+    ]
+    for dimension in COUNTED:
+        value = func.coalesce(columns[dimension], "")
+        queries.append(
+            select(
+                columns.short_url,
+                literal(dimension),
+                value,
+                func.count(),
+                literal(0.0),
+            )
+            .where(where)
+            .group_by(columns.short_url, value)
+        )
+    for dimension in SUMMED:
+        queries.append(
+            select(
+                columns.short_url,
+                literal(dimension),
+                literal(""),
+                func.count(columns[dimension]),
+                func.coalesce(func.sum(columns[dimension]), 0.0),
+            )
+            .where(where)
+            .group_by(columns.short_url)
+        )
+    return queries
+
+
+def _rebuild_sketches(short_urls):
+    """
+    Build the sketches of short URLs from their raw clicks, one short URL at a time, in the caller's transaction.
+    """
+
+    columns = Stat.__table__.c
+    rows = db.session.execute(
+        select(columns.short_url, columns.entry_time, columns.ip)
+        .where(columns.short_url.in_(short_urls))
+        .order_by(columns.short_url)
+        .execution_options(yield_per=10000)
+    ).mappings()
+
+    def write(sketches):
+        db.session.execute(
+            insert(UniqueSketch),
+            [
+                {"short_url": short_url, "day": day, "sketch": sketch.to_bytes()}
+                for (short_url, day), sketch in sketches.items()
+            ],
+        )
+
+    # Only one short URL's sketches are kept in memory at a time.
+    sketches = {}
+    current = None
+    for partition in rows.partitions():
+        for key, ips in _sketch_ips(partition).items():
+            if key[0] != current:
+                if sketches:
+                    write(sketches)
+                sketches = {}
+                current = key[0]
+            sketch = sketches.get(key)
+            if sketch is None:
+                sketch = sketches[key] = HyperLogLog(app.config["HLL_PRECISION"])
+            sketch.update(ips)
+    if sketches:
+        write(sketches)
+
+
+def rebuild(short_urls):
+    """
+    Recompute the counters of short URLs from their raw clicks.
+
+    The old counters are replaced in the same transaction, 500 short URLs at a time, so readers never see them half built.
+
+    Args:
+        short_urls (list): The short URLs.
+
+    Returns:
+        None
+    """
+
+    table = Rollup.__table__
+    buckets = ClickBucket.__table__
+    sketches = UniqueSketch.__table__
+    columns = Stat.__table__.c
+    short_urls = list(short_urls)
+
+    # Stay well below SQLite's limit on the number of bound parameters per query.
+    for start in range(0, len(short_urls), 500):
+        chunk = short_urls[start : start + 500]
+        try:
+            db.session.execute(table.delete().where(table.c.short_url.in_(chunk)))
+            for query in _aggregates(columns.short_url.in_(chunk)):
+                db.session.execute(
+                    insert(table).from_select(
+                        ["short_url", "dimension", "value", "entries", "total"], query
+                    )
+                )
+
+            db.session.execute(buckets.delete().where(buckets.c.short_url.in_(chunk)))
+            bucket = columns.entry_time // BUCKET_SIZE * BUCKET_SIZE
+            db.session.execute(
+                insert(buckets).from_select(
+                    ["short_url", "bucket", "entries"],
+                    select(columns.short_url, bucket, func.count())
+                    .where(
+                        columns.short_url.in_(chunk), columns.entry_time.is_not(None)
+                    )
+                    .group_by(columns.short_url, bucket),
+                )
+            )
+            db.session.execute(sketches.delete().where(sketches.c.short_url.in_(chunk)))
+            _rebuild_sketches(chunk)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def rebuild_all(chunk_size=500):
+    """
+    Recompute every counter from the raw clicks, a chunk of short URLs at a time.
+
+    Counters of short URLs without any clicks left are removed.
+
+    Args:
+        chunk_size (int, optional): The number of short URLs rebuilt per transaction.
+
+    Returns:
+        int: The number of short URLs rebuilt.
+    """
+
+    columns = Stat.__table__.c
+    rebuilt = 0
+    last_short_url = ""
+    while True:
+        chunk = (
+            db.session.execute(
+                select(columns.short_url)
+                .where(columns.short_url > last_short_url)
+                .distinct()
+                .order_by(columns.short_url)
+                .limit(chunk_size)
+            )
+            .scalars()
+            .all()
+        )
+        if not chunk:
+            break
+        rebuild(chunk)
+        rebuilt += len(chunk)
+        last_short_url = chunk[-1]
+
+    for table in (Rollup.__table__, ClickBucket.__table__, UniqueSketch.__table__):
+        db.session.execute(
+            table.delete().where(table.c.short_url.not_in(select(columns.short_url)))
+        )
+    db.session.commit()
+    return rebuilt
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        if sys.argv[1:]:
+            rebuild(sys.argv[1:])
+            print(f"Rebuilt the counters of {len(sys.argv[1:])} short URLs.")
+        else:
+            print(f"Rebuilt the counters of {rebuild_all()} short URLs.")
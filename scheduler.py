@@ -0,0 +1,265 @@
+"""
+Expiry Scheduler Module
+
+This module reaps expired short URLs when they are due, instead of polling the whole table on a fixed interval.
+Upcoming expirations are kept in a min-heap, loaded a window at a time from the expires_at index,
+and the scheduler sleeps until the soonest one is due. Short URLs created or updated in the same process
+add their new deadlines as they are saved, waking the scheduler early if they are due sooner.
+
+Expired short URLs already stop resolving on their own, so reaping is garbage collection of their rows and clicks:
+sweeps are at least sweep_interval seconds apart, and deadlines passing in between are reaped together.
+
+Deadlines only decide when to wake: each wake-up reaps every URL due by then through the expires_at index,
+so stale deadlines of URLs updated or deleted since are harmless.
+Deadlines saved by other processes reach the heap when it is reloaded, every rescan_interval seconds.
+When the database fails, for example because it's locked, the scheduler rolls back, backs off, and tries again,
+waiting twice as long after each consecutive failure, up to sweep_interval seconds.
+
+Classes:
+    - ExpiryScheduler: A heap of upcoming expirations and the loop reaping them when due.
+
+Author: Yousef Saeed
+"""
+
+from heapq import heappush, heappop
+from threading import Condition
+from time import time
+
+from database import *
+
+
+class ExpiryScheduler:
+    """
+    ExpiryScheduler is a class for reaping expired short URLs as their expiration dates pass.
+
+    Attributes:
+        batch_size (int): The maximum number of URLs deleted per batch when reaping.
+        load_size (int): The number of upcoming deadlines loaded from the database at a time.
+        rescan_interval (float): Seconds between reloads of the heap, to pick up deadlines saved by other processes.
+        sweep_interval (float): The minimum number of seconds between sweeps.
+
+    Methods:
+        - schedule(short_url, expires_at)
+        - run(on_sweep=None, on_error=None)
+        - stop()
+        - stats()
+    """
+
+    def __init__(
+        self, batch_size=500, load_size=1000, rescan_interval=3600, sweep_interval=300
+    ):
+        """
+        Initialize ExpiryScheduler with its batch sizes.
+
+        Args:
+            batch_size (int, optional): The maximum number of URLs deleted per batch when reaping.
+            load_size (int, optional): The number of upcoming deadlines loaded from the database at a time.
+            rescan_interval (float, optional): Seconds between reloads of the heap.
+            sweep_interval (float, optional): The minimum number of seconds between sweeps.
+        """
+
+        self.batch_size = batch_size
+        self.load_size = load_size
+        self.rescan_interval = rescan_interval
+        self.sweep_interval = sweep_interval
+
+        self.loads = 0
+        self.sweeps = 0
+        self.reaped = 0
+        self.failures = 0
+
+        self._heap = []
+        # The latest deadline loaded from the database: None before the first load, infinity once all are loaded.
+        self._loaded_until = None
+        self._rescan_at = 0
+        self._sweep_at = 0
+        self._running = False
+        self._condition = Condition()
+
+    def schedule(self, short_url, expires_at):
+        """
+        Add the deadline of a short URL that was just created or updated.
+
+        Deadlines are only kept while the scheduler runs in this process;
+        otherwise the scheduler running elsewhere loads them from the database.
+
+        Args:
+            short_url (str): The short URL.
+            expires_at (int): When the short URL expires, in seconds since the epoch, or None if it doesn't.
+
+        Returns:
+            None
+        """
+
+        if expires_at is None or not self._running:
+            return
+
+        with self._condition:
+            heappush(self._heap, (expires_at, short_url))
+            # Wake the scheduler if the new deadline comes before the one it sleeps until.
+            if self._heap[0][0] == expires_at:
+                self._condition.notify()
+
+    def run(self, on_sweep=None, on_error=None):
+        """
+        Reap expired short URLs as they become due, until stop() is called.
+
+        Must be run by a single process, in its own thread.
+        Database errors don't stop it: the failed load or sweep is retried after backing off.
+
+        Args:
+            on_sweep (function, optional): Called with the result of each Shortener.delete_expired_urls() sweep.
+            on_error (function, optional): Called with the exception of each failed load or sweep.
+
+        Returns:
+            None
+        """
+
+        from shortener import Shortener
+
+        with self._condition:
+            self._running = True
+
+        with app.app_context():
+            shortener = Shortener()
+            failures = 0
+            while True:
+                try:
+                    if not self._wait():
+                        break
+                    sweep = shortener.delete_expired_urls(self.batch_size)
+                except Exception as error:
+                    db.session.rollback()
+                    failures += 1
+                    self.failures += 1
+                    if on_error is not None:
+                        on_error(error)
+                    # Reload the deadlines and sweep again once backed off, since the due URLs weren't reaped.
+                    self._rescan_at = 0
+                    self._sweep_at = 0
+                    if not self._back_off(
+                        min(2 ** (failures - 1), max(self.sweep_interval, 1))
+                    ):
+                        break
+                    continue
+
+                failures = 0
+                self.sweeps += 1
+                self.reaped += sweep["reaped"]
+                if on_sweep is not None:
+                    on_sweep(sweep)
+
+    def stop(self):
+        """
+        Stop the scheduler after its current sweep.
+
+        Returns:
+            None
+        """
+
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def stats(self):
+        """
+        Get counters describing the scheduler's activity.
+
+        Returns:
+            dict: The number of pending deadlines, the soonest one, and the number of loads, sweeps, URLs reaped,
+                and failed loads or sweeps.
+        """
+
+        with self._condition:
+            return {
+                "pending": len(self._heap),
+                "next_deadline": self._heap[0][0] if self._heap else None,
+                "loads": self.loads,
+                "sweeps": self.sweeps,
+                "reaped": self.reaped,
+                "failures": self.failures,
+            }
+
+    def _wait(self):
+        """
+        Sleep until the soonest deadline is due and the last sweep was long enough ago,
+        loading deadlines from the database as the heap runs out.
+
+        Returns:
+            bool: True when deadlines are due, False when the scheduler was stopped.
+        """
+
+        while True:
+            now = time()
+            if now >= self._rescan_at:
+                with self._condition:
+                    self._heap = []
+                    self._loaded_until = None
+                self._rescan_at = now + self.rescan_interval
+
+            # Load more once every loaded deadline has passed, since the next ones may come before any pushed since.
+            if self._loaded_until != float("inf") and (
+                not self._heap
+                or self._loaded_until is None
+                or self._heap[0][0] > self._loaded_until
+            ):
+                self._load()
+
+            with self._condition:
+                if not self._running:
+                    return False
+
+                if self._heap and self._heap[0][0] <= now and self._sweep_at <= now:
+                    while self._heap and self._heap[0][0] <= now:
+                        heappop(self._heap)
+                    self._sweep_at = now + self.sweep_interval
+                    return True
+
+                next_wake = self._rescan_at
+                if self._heap:
+                    next_wake = min(next_wake, max(self._heap[0][0], self._sweep_at))
+                self._condition.wait(next_wake - now)
+
+    def _back_off(self, delay):
+        """
+        Sleep for delay seconds after a failure, or until the scheduler is stopped.
+
+        Returns:
+            bool: True when the scheduler should try again, False when it was stopped.
+        """
+
+        with self._condition:
+            if self._running:
+                self._condition.wait(delay)
+            return self._running
+
+    def _load(self):
+        """
+        Load the next load_size deadlines from the expires_at index onto the heap.
+        """
+
+        query = db.select(Url.short_url, Url.expires_at).where(
+            Url.expires_at.is_not(None)
+        )
+        if self._loaded_until is not None:
+            query = query.where(Url.expires_at > self._loaded_until)
+        rows = db.session.execute(
+            query.order_by(Url.expires_at).limit(self.load_size)
+        ).all()
+        db.session.commit()
+
+        with self._condition:
+            for row in rows:
+                heappush(self._heap, (row.expires_at, row.short_url))
+            self._loaded_until = (
+                rows[-1].expires_at if len(rows) == self.load_size else float("inf")
+            )
+        self.loads += 1
+
+
+scheduler = ExpiryScheduler(
+    batch_size=app.config["EXPIRY_BATCH_SIZE"],
+    load_size=app.config["EXPIRY_LOAD_SIZE"],
+    rescan_interval=app.config["EXPIRY_RESCAN_INTERVAL"],
+    sweep_interval=app.config["EXPIRY_SWEEP_INTERVAL"],
+)
@@ -6,18 +6,182 @@ It includes functionality for creating, managing, and resolving short URLs.
 The short URLs can have an optional expiration date and can be associated with a user ID.
 
 The module uses a database to store URL mappings, and it can also delete expired short URLs and associated analytics data.
+Resolved short URLs are cached in memory, along with short URLs that don't exist, so hot links and 404 floods
+don't reach the database on every request. Each process has its own caches, so updated and deleted short URLs
+are logged in the database and dropped by every process within RESOLVE_CACHE_SYNC_INTERVAL seconds.
+Short URLs stop resolving as soon as they expire, and new and updated expiration dates are handed to the expiry
+scheduler, which deletes expired short URLs later.
+
+With SHORTEN_DEDUP enabled, shortening a long URL its owner already has an unexpired short URL for returns that
+short URL instead of creating another. Long URLs are compared after normalization and looked up by an indexed hash.
 
 Classes:
+    - Resolution: The long URL and expiry a short URL resolves to.
     - Shortener: The main class for URL shortening, including methods for generating, managing, and resolving short URLs.
 
 Author: Yousef Saeed
 """
 
 import datetime
-from random import choice
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from hashlib import sha256
+from urllib.parse import urlsplit, urlunsplit
+from threading import Lock
+from time import monotonic, perf_counter, time
+from sqlalchemy import delete, func, insert
+from sqlalchemy.exc import IntegrityError
 from string import ascii_lowercase, digits
 
 from database import *
+from cache import LRUCache
+from allocator import allocator
+from scheduler import scheduler
+
+
+Resolution = namedtuple("Resolution", ["long_url", "expires_at"])
+
+resolutions = LRUCache(
+    maxsize=app.config["RESOLVE_CACHE_SIZE"], ttl=app.config["RESOLVE_CACHE_TTL"]
+)
+unknown_short_urls = LRUCache(
+    maxsize=app.config["RESOLVE_MISS_CACHE_SIZE"],
+    ttl=app.config["RESOLVE_MISS_CACHE_TTL"],
+)
+
+# The last invalidation this process has read, and when to read the ones logged since.
+_synced_id = None
+_next_sync = 0.0
+_sync_lock = Lock()
+
+
+def normalize_url(long_url):
+    """
+    Normalize a long URL, so equivalent spellings of the same URL compare equal.
+
+    The scheme defaults to https, as it does when redirecting, the scheme and host are lowercased,
+    default ports are dropped, and an empty path becomes "/".
+
+    Args:
+        long_url (str): The long URL.
+
+    Returns:
+        str: The normalized long URL.
+    """
+
+    long_url = long_url.strip()
+    if "://" not in long_url:
+        long_url = f"https://{long_url}"
+
+    parts = urlsplit(long_url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rpartition(":")[2]) in [("http", "80"), ("https", "443")]:
+        netloc = netloc.rpartition(":")[0]
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def hash_url(long_url):
+    """
+    Hash a long URL for the indexed long URL lookup.
+
+    Args:
+        long_url (str): The long URL.
+
+    Returns:
+        int: A signed 64-bit hash of the normalized long URL.
+    """
+
+    digest = sha256(normalize_url(long_url).encode()).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+
+def encode_cursor(url):
+    """
+    Encode the position of a short URL in a listing as an opaque pagination cursor.
+
+    Args:
+        url (Url): The last short URL of a page.
+
+    Returns:
+        str: The cursor of the next page.
+    """
+
+    position = f"{url.created_at}:{url.short_url}".encode()
+    return urlsafe_b64encode(position).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Decode a pagination cursor.
+
+    Args:
+        cursor (str): The cursor, as returned by encode_cursor().
+
+    Returns:
+        tuple: The creation time and short URL the next page starts after.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+
+    position = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    created_at, short_url = position.split(":", 1)
+    return int(created_at), short_url
+
+
+def resolution_stats():
+    """
+    Get metrics describing the short URL resolution caches.
+
+    Returns:
+        dict: The size, hits, misses, and hit ratio of the resolved and unknown short URL caches.
+    """
+
+    return {
+        "resolved": resolutions.stats(),
+        "unknown": unknown_short_urls.stats(),
+    }
+
+
+def sync_caches():
+    """
+    Drop the short URLs other processes deleted or updated from this process's resolution caches.
+
+    The invalidation log is read at most once every RESOLVE_CACHE_SYNC_INTERVAL seconds, and by one thread at a time,
+    so a stale resolution is served for at most that long after another process changes a short URL.
+
+    Returns:
+        int: The number of invalidations read.
+    """
+
+    global _synced_id, _next_sync
+
+    if monotonic() < _next_sync or not _sync_lock.acquire(blocking=False):
+        return 0
+
+    try:
+        invalidations = []
+        if _synced_id is None:
+            # Nothing was cached before the first read, so only the invalidations logged from now on matter.
+            last_id = db.session.execute(db.select(func.max(Invalidation.id))).scalar()
+            _synced_id = last_id or 0
+        else:
+            invalidations = db.session.execute(
+                db.select(Invalidation.id, Invalidation.short_url)
+                .where(Invalidation.id > _synced_id)
+                .order_by(Invalidation.id)
+            ).all()
+            for invalidation in invalidations:
+                resolutions.delete(invalidation.short_url)
+                unknown_short_urls.delete(invalidation.short_url)
+            if invalidations:
+                _synced_id = invalidations[-1].id
+
+        _next_sync = monotonic() + app.config["RESOLVE_CACHE_SYNC_INTERVAL"]
+        return len(invalidations)
+    finally:
+        _sync_lock.release()
 
 
 class Shortener:
@@ -26,30 +190,33 @@ class Shortener:
 
     Attributes:
         chars (str): A string containing lowercase letters and digits for generating short URLs.
-        chars_len (int): The length of the characters used in short URLs, determined based on the number of URLs in the database.
 
     Methods:
         - check_datetime_format(datetime_str)
         - convert_datetime_format(datetime_str)
         - generate_short_url()
+        - generate_short_urls(count)
+        - find_duplicates(urls)
+        - list_urls(user_id, limit, cursor=None)
+        - iter_urls(user_id, chunk_size=1000)
         - shorten_url(long_url, expiration_date=None, is_permanent=False, user_id=None)
+        - shorten_urls(urls)
         - resolve_short_url(short_url)
+        - resolve(short_url)
+        - preload(short_urls)
+        - invalidate(short_urls, broadcast=True)
         - update_exp_date(short_url, expiration_date)
         - delete_short_url(short_url)
-        - delete_expired_urls()
+        - delete_short_urls(short_urls)
+        - delete_expired_urls(batch_size=500)
     """
 
     def __init__(self):
         """
-        Initialize Shortener with character set and character length.
+        Initialize Shortener with character set.
         """
 
         self.chars = ascii_lowercase + digits
-        self.chars_len = (
-            4
-            if len(str(db.session.query(Url).count())) < 4
-            else len(str(db.session.query(Url).count()))
-        )
 
     def check_datetime_format(self, datetime_str):
         """
@@ -85,24 +252,105 @@ class Shortener:
 
     def generate_short_url(self):
         """
-        Generate a random short URL.
+        Generate a new short URL.
+
+        Short URLs are allocated from a counter shared by every process, so no two calls return the same one.
 
         Returns:
-            str: A randomly generated short URL.
+            str: A newly allocated short URL.
         """
 
-        # Generate a random string of 6 characters.
-        short_url = "".join([choice(self.chars) for _ in range(self.chars_len)])
+        return allocator.allocate()
 
-        # Check if the short URL already exists in the database.
-        url = Url.query.filter_by(short_url=short_url).first()
+    def generate_short_urls(self, count):
+        """
+        Generate several new short URLs at once.
 
-        # If the short URL already exists, generate a new one.
-        while url is not None:
-            short_url = "".join([choice(self.chars) for _ in range(self.chars_len)])
-            url = Url.query.filter_by(short_url=short_url).first()
+        Args:
+            count (int): The number of short URLs to generate.
 
-        return short_url
+        Returns:
+            list: The newly allocated short URLs.
+        """
+
+        return allocator.allocate_many(count)
+
+    def find_duplicates(self, urls):
+        """
+        Find the unexpired short URLs that already exist for long URLs.
+
+        A short URL is a duplicate if it has the same owner, the same normalized long URL, and the same permanence.
+        When an expiration date is requested, it must also expire at that time;
+        otherwise it must expire no sooner than a new short URL with the default expiry would,
+        so the caller never gets back a short URL that expires earlier than the one they asked for.
+
+        Args:
+            urls (list): The keyword arguments of shorten_url() for each long URL.
+
+        Returns:
+            list: The existing short URL for each long URL, or None if there isn't one.
+        """
+
+        hashes = [hash_url(url["long_url"]) for url in urls]
+        now = datetime.datetime.now()
+        current_time = int(now.timestamp())
+        # Default expiration dates are stored to the minute, like in shorten_url().
+        default_expires_at = int(
+            (now + datetime.timedelta(days=7)).replace(second=0, microsecond=0).timestamp()
+        )
+        candidates = {}
+
+        # Stay well below SQLite's limit on the number of bound parameters per query.
+        unique_hashes = list(set(hashes))
+        for start in range(0, len(unique_hashes), 500):
+            rows = db.session.execute(
+                db.select(
+                    Url.url_hash,
+                    Url.short_url,
+                    Url.long_url,
+                    Url.user_id,
+                    Url.is_permanent,
+                    Url.expires_at,
+                ).where(
+                    Url.url_hash.in_(unique_hashes[start : start + 500]),
+                    db.or_(Url.expires_at.is_(None), Url.expires_at > current_time),
+                )
+            )
+            for row in rows:
+                candidates.setdefault(row.url_hash, []).append(row)
+
+        duplicates = []
+        for url, url_hash in zip(urls, hashes):
+            long_url = normalize_url(url["long_url"])
+            is_permanent = bool(url.get("is_permanent", False))
+            expires_at = None
+            if url.get("expiration_date") is not None:
+                expires_at = int(
+                    datetime.datetime.strptime(
+                        url["expiration_date"], "%d-%m-%Y.%H:%M"
+                    ).timestamp()
+                )
+
+            duplicate = None
+            for row in candidates.get(url_hash, []):
+                if (
+                    row.user_id != url.get("user_id")
+                    or bool(row.is_permanent) != is_permanent
+                    or normalize_url(row.long_url) != long_url
+                ):
+                    continue
+                if (
+                    is_permanent
+                    or expires_at is not None
+                    and row.expires_at == expires_at
+                    or expires_at is None
+                    and (row.expires_at is None or row.expires_at >= default_expires_at)
+                ):
+                    duplicate = row.short_url
+                    break
+            duplicates.append(duplicate)
+
+        return duplicates
 
     def shorten_url(
         self, long_url, expiration_date=None, is_permanent=False, user_id=None
@@ -110,6 +358,8 @@ class Shortener:
         """
         Shorten a long URL and store it in the database.
 
+        With SHORTEN_DEDUP enabled, an existing unexpired short URL for the same long URL is returned instead.
+
         Args:
             long_url (str): The long URL to be shortened.
             expiration_date (str, optional): The expiration date of the short URL.
@@ -120,27 +370,204 @@ class Shortener:
             str: The generated short URL.
         """
 
+        if app.config["SHORTEN_DEDUP"]:
+            short_url = self.find_duplicates(
+                [
+                    {
+                        "long_url": long_url,
+                        "expiration_date": expiration_date,
+                        "is_permanent": is_permanent,
+                        "user_id": user_id,
+                    }
+                ]
+            )[0]
+            if short_url is not None:
+                return short_url
+
         # Generate a new short URL and store the mapping in the database.
-        short_url = Url.query.filter_by(long_url=long_url).first()
-        short_url = self.generate_short_url()
-        creation_date = datetime.datetime.now().strftime("%d-%m-%Y.%H:%M:%S")
+        created_at = int(time())
         if expiration_date is None and is_permanent == False:
             expiration_date = (
                 datetime.datetime.now() + datetime.timedelta(days=7)
             ).strftime("%d-%m-%Y.%H:%M")
-        new_url = Url(
-            short_url=short_url,
-            long_url=long_url,
-            creation_date=creation_date,
-            expiration_date=expiration_date,
-            is_permanent=is_permanent,
-            user_id=user_id,
-        )
-        db.session.add(new_url)
-        db.session.commit()
+        while True:
+            short_url = self.generate_short_url()
+            new_url = Url(
+                short_url=short_url,
+                long_url=long_url,
+                url_hash=hash_url(long_url),
+                created_at=created_at,
+                expiration_date=expiration_date,
+                is_permanent=is_permanent,
+                user_id=user_id,
+            )
+            expires_at = new_url.expires_at
+            db.session.add(new_url)
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                # The short URL was taken by a random short URL from before the counter existed.
+                db.session.rollback()
+        self.invalidate([short_url], broadcast=False)
+        scheduler.schedule(short_url, expires_at)
 
         return short_url
 
+    def shorten_urls(self, urls):
+        """
+        Shorten many long URLs and store them in a single transaction.
+
+        With SHORTEN_DEDUP enabled, existing unexpired short URLs are returned for long URLs that already have one,
+        and repeats of the same long URL share a single new short URL.
+
+        Args:
+            urls (list): The keyword arguments of shorten_url() for each long URL.
+
+        Returns:
+            list: The short URLs, in the same order.
+        """
+
+        if not app.config["SHORTEN_DEDUP"]:
+            return self._store_urls(urls)
+
+        short_urls = self.find_duplicates(urls)
+        keys = [
+            (
+                normalize_url(url["long_url"]),
+                url.get("user_id"),
+                bool(url.get("is_permanent", False)),
+                url.get("expiration_date"),
+            )
+            for url in urls
+        ]
+
+        new_urls = {}
+        for url, key, short_url in zip(urls, keys, short_urls):
+            if short_url is None:
+                new_urls.setdefault(key, url)
+        new_short_urls = dict(zip(new_urls, self._store_urls(list(new_urls.values()))))
+
+        return [
+            short_url if short_url is not None else new_short_urls[key]
+            for key, short_url in zip(keys, short_urls)
+        ]
+
+    def _store_urls(self, urls):
+        """
+        Store new short URLs for many long URLs in a single transaction.
+
+        Args:
+            urls (list): The keyword arguments of shorten_url() for each long URL.
+
+        Returns:
+            list: The generated short URLs, in the same order.
+        """
+
+        if not urls:
+            return []
+
+        current_time = datetime.datetime.now()
+        created_at = int(current_time.timestamp())
+        default_expires_at = int(
+            (current_time + datetime.timedelta(days=7)).replace(second=0).timestamp()
+        )
+        expires_at = {None: None}
+
+        rows = []
+        for url, short_url in zip(urls, self.generate_short_urls(len(urls))):
+            expiration_date = url.get("expiration_date")
+            if expiration_date not in expires_at:
+                expires_at[expiration_date] = int(
+                    datetime.datetime.strptime(
+                        expiration_date, "%d-%m-%Y.%H:%M"
+                    ).timestamp()
+                )
+            is_permanent = url.get("is_permanent", False)
+            rows.append(
+                {
+                    "short_url": short_url,
+                    "long_url": url["long_url"],
+                    "url_hash": hash_url(url["long_url"]),
+                    "created_at": created_at,
+                    "expires_at": (
+                        default_expires_at
+                        if expiration_date is None and is_permanent == False
+                        else expires_at[expiration_date]
+                    ),
+                    "is_permanent": is_permanent,
+                    "user_id": url.get("user_id"),
+                }
+            )
+
+        # Insert the rows directly, skipping the overhead of building and flushing an ORM object per URL.
+        try:
+            db.session.execute(insert(Url), rows)
+            db.session.commit()
+        except IntegrityError:
+            # A random short URL from before the counter existed was allocated again; store them one by one instead.
+            db.session.rollback()
+            return [self.shorten_url(**url) for url in urls]
+
+        short_urls = [row["short_url"] for row in rows]
+        self.invalidate(short_urls, broadcast=False)
+        for row in rows:
+            scheduler.schedule(row["short_url"], row["expires_at"])
+        return short_urls
+
+    def list_urls(self, user_id, limit, cursor=None):
+        """
+        Get a page of a user's short URLs, newest first.
+
+        Pages are found by seeking the (user_id, created_at, short_url) index to the cursor,
+        so every page costs the same however deep into the listing it is.
+
+        Args:
+            user_id (str): The user whose short URLs to list.
+            limit (int): The maximum number of short URLs on the page.
+            cursor (str, optional): The cursor returned with the previous page.
+
+        Returns:
+            tuple: The page's Url objects, and the cursor of the next page or None if this is the last one.
+
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+
+        query = db.session.query(Url).where(Url.user_id == user_id)
+        if cursor is not None:
+            query = query.where(
+                db.tuple_(Url.created_at, Url.short_url) < decode_cursor(cursor)
+            )
+        urls = (
+            query.order_by(Url.created_at.desc(), Url.short_url.desc())
+            .limit(limit + 1)
+            .all()
+        )
+
+        if len(urls) > limit:
+            return urls[:limit], encode_cursor(urls[limit - 1])
+        return urls, None
+
+    def iter_urls(self, user_id, chunk_size=1000):
+        """
+        Iterate over all of a user's short URLs, newest first, one page at a time.
+
+        Args:
+            user_id (str): The user whose short URLs to list.
+            chunk_size (int, optional): The number of short URLs fetched per query.
+
+        Yields:
+            Url: Each short URL.
+        """
+
+        cursor = None
+        while True:
+            urls, cursor = self.list_urls(user_id, chunk_size, cursor)
+            yield from urls
+            if cursor is None:
+                return
+
     def resolve_short_url(self, short_url):
         """
         Resolve a short URL and return its details.
@@ -156,13 +583,115 @@ class Shortener:
 
         return url if url is not None else None
 
+    def resolve(self, short_url):
+        """
+        Resolve a short URL to its long URL and expiry, using the resolution caches when possible.
+
+        A short URL is gone as soon as it expires, whether or not the expiry scheduler has deleted it yet.
+        Its expiry is cached with the long URL, so this costs a comparison rather than a query.
+
+        Args:
+            short_url (str): The short URL to be resolved.
+
+        Returns:
+            Resolution: The long URL and expiry of the short URL, or None if the short URL does not exist or has expired.
+        """
+
+        sync_caches()
+        resolution = resolutions.get(short_url)
+        if resolution is None:
+            if unknown_short_urls.get(short_url) is not None:
+                return None
+
+            row = db.session.execute(
+                db.select(Url.long_url, Url.expires_at).where(
+                    Url.short_url == short_url
+                )
+            ).first()
+            if row is None:
+                unknown_short_urls.set(short_url, True)
+                return None
+
+            resolution = Resolution(*row)
+            resolutions.set(short_url, resolution)
+
+        if resolution.expires_at is not None and resolution.expires_at <= time():
+            return None
+        return resolution
+
+    def preload(self, short_urls):
+        """
+        Resolve many short URLs at once and cache their resolutions, so their first redirects skip the database.
+
+        Args:
+            short_urls (list): The short URLs to resolve.
+
+        Returns:
+            int: The number of short URLs cached.
+        """
+
+        sync_caches()
+        short_urls = list(short_urls)
+        cached = 0
+
+        # Stay well below SQLite's limit on the number of bound parameters per query.
+        for start in range(0, len(short_urls), 500):
+            rows = db.session.execute(
+                db.select(Url.short_url, Url.long_url, Url.expires_at).where(
+                    Url.short_url.in_(short_urls[start : start + 500])
+                )
+            )
+            for row in rows:
+                resolutions.set(row.short_url, Resolution(row.long_url, row.expires_at))
+                cached += 1
+
+        return cached
+
+    def invalidate(self, short_urls, broadcast=True):
+        """
+        Drop short URLs from the resolution caches after they are created, updated, or deleted.
+
+        Updated and deleted short URLs are also logged, so other processes drop them within
+        RESOLVE_CACHE_SYNC_INTERVAL seconds, see sync_caches(). Created short URLs aren't:
+        other processes only cache them as unknown for up to RESOLVE_MISS_CACHE_TTL seconds.
+
+        Args:
+            short_urls (list): The short URLs to drop.
+            broadcast (bool, optional): Whether to log the short URLs for other processes.
+
+        Returns:
+            None
+        """
+
+        short_urls = list(short_urls)
+        for short_url in short_urls:
+            resolutions.delete(short_url)
+            unknown_short_urls.delete(short_url)
+
+        if not broadcast or not short_urls:
+            return
+
+        now = int(time())
+        db.session.execute(
+            insert(Invalidation),
+            [{"short_url": short_url, "created_at": now} for short_url in short_urls],
+        )
+        # Invalidations older than every cache entry are no longer needed by any process.
+        max_age = max(
+            app.config["RESOLVE_CACHE_TTL"], app.config["RESOLVE_MISS_CACHE_TTL"]
+        )
+        db.session.execute(
+            delete(Invalidation).where(Invalidation.created_at < now - 2 * max_age)
+        )
+        db.session.commit()
+
     def update_exp_date(self, short_url, expiration_date):
         """
         Update the expiration date of a short URL in the database.
 
         Args:
             short_url (str): The short URL to be updated.
-            expiration_date (str): The new expiration date in "%d-%m-%Y.%H:%M" format.
+            expiration_date (str): The new expiration date in "%d-%m-%Y.%H:%M" format, or None to make the short URL permanent.
 
         Returns:
             None
@@ -170,11 +699,15 @@ class Shortener:
 
         url = Url.query.filter_by(short_url=short_url).first()
         url.expiration_date = expiration_date
+        url.is_permanent = expiration_date is None
+        expires_at = url.expires_at
         db.session.commit()
+        self.invalidate([short_url])
+        scheduler.schedule(short_url, expires_at)
 
     def delete_short_url(self, short_url):
         """
-        Delete a short URL from the database.
+        Delete a short URL and its analytics data from the database.
 
         Args:
             short_url (str): The short URL to be deleted.
@@ -183,26 +716,70 @@ class Shortener:
             None
         """
 
-        url = Url.query.filter_by(short_url=short_url).first()
-        db.session.delete(url)
-        db.session.commit()
+        self.delete_short_urls([short_url])
 
-    def delete_expired_urls(self):
+    def delete_short_urls(self, short_urls):
         """
-        Delete expired short URLs from the database and associated analytics data.
+        Delete short URLs and their analytics data from the database with set-based deletes.
+
+        Clicks are deleted first, so an interrupted delete never leaves clicks behind for a URL that no longer exists.
+        Rows are deleted in chunks, each in its own transaction.
+
+        Args:
+            short_urls (list): The short URLs to be deleted.
 
         Returns:
-            None
+            int: The number of short URLs deleted.
         """
 
-        current_time = datetime.datetime.now().strftime("%d-%m-%Y.%H:%M")
-        expired_urls = db.session.query(Url).where(Url.expiration_date <= current_time)
-        if expired_urls.count() > 0:
-            from analyzer import Analyzer
+        from analyzer import Analyzer
 
-            analyzer = Analyzer()
-            for url in expired_urls:
-                analyzer.short_url = url.short_url
-                analyzer.delete()
-                db.session.delete(url)
-                db.session.commit()
+        short_urls = list(short_urls)
+        Analyzer().delete(short_urls)
+
+        # Stay well below SQLite's limit on the number of bound parameters per query.
+        deleted = 0
+        for start in range(0, len(short_urls), 500):
+            deleted += db.session.execute(
+                Url.__table__.delete().where(
+                    Url.__table__.c.short_url.in_(short_urls[start : start + 500])
+                )
+            ).rowcount
+            db.session.commit()
+        self.invalidate(short_urls)
+
+        return deleted
+
+    def delete_expired_urls(self, batch_size=500):
+        """
+        Delete expired short URLs from the database and associated analytics data.
+
+        Due URLs are pulled through the expires_at index in batches of batch_size, soonest expiry first,
+        and each batch is deleted with set-based deletes.
+
+        Args:
+            batch_size (int, optional): The maximum number of URLs to delete per batch.
+
+        Returns:
+            dict: The number of URLs reaped and the duration of the sweep in seconds.
+        """
+
+        start_time = perf_counter()
+        current_time = int(time())
+        reaped = 0
+
+        while True:
+            expired_urls = (
+                db.session.query(Url.short_url)
+                .where(Url.expires_at <= current_time)
+                .order_by(Url.expires_at)
+                .limit(batch_size)
+                .all()
+            )
+            self.delete_short_urls([url.short_url for url in expired_urls])
+            reaped += len(expired_urls)
+
+            if len(expired_urls) < batch_size:
+                break
+
+        return {"reaped": reaped, "duration": perf_counter() - start_time}
@@ -0,0 +1,138 @@
+"""
+API Tests
+
+Tests for the incremental JSON reader behind /api/shorten/bulk. Every body is read at every chunk size,
+so each value, escape, and multi-byte character is also split across reads at every position.
+
+Run them with "python -m unittest discover tests" from the repository root.
+
+Author: Yousef Saeed
+"""
+
+from io import BytesIO
+from json import JSONDecodeError, dumps
+import unittest
+
+from api import read_json_records
+
+
+def read_all(body, chunk_size, max_record_size=65536):
+    """
+    Read a body with read_json_records() and return what it yields.
+    """
+
+    stream = BytesIO(body.encode())
+    return list(read_json_records(stream, chunk_size, max_record_size))
+
+
+class ReadJsonRecordsTest(unittest.TestCase):
+    """
+    ReadJsonRecordsTest is a class for testing read_json_records() on arrays and NDJSON at every chunk size.
+    """
+
+    def assert_records(self, body, expected, max_record_size=65536):
+        """
+        Assert a body is read as the expected records, whatever the chunk size.
+        """
+
+        for chunk_size in range(1, len(body.encode()) + 2):
+            with self.subTest(chunk_size=chunk_size):
+                records = read_all(body, chunk_size, max_record_size)
+                self.assertEqual(
+                    [(number, record) for number, record in records], expected
+                )
+
+    def assert_error(self, body, records, message, max_record_size=65536):
+        """
+        Assert a body is read as some records followed by an error, whatever the chunk size.
+        """
+
+        for chunk_size in range(1, len(body.encode()) + 2):
+            with self.subTest(chunk_size=chunk_size):
+                result = read_all(body, chunk_size, max_record_size)
+                self.assertEqual(result[:-1], list(enumerate(records, start=1)))
+                number, error = result[-1]
+                self.assertEqual(number, len(records) + 1)
+                self.assertIsInstance(error, JSONDecodeError)
+                self.assertTrue(error.msg.startswith(message), error.msg)
+
+    def test_empty_bodies(self):
+        self.assert_records("", [])
+        self.assert_records(" \n ", [])
+        self.assert_records("[]", [])
+        self.assert_records(" [ \n ] \n", [])
+
+    def test_array(self):
+        records = [
+            {"url": "example.com", "note": "café ✓ \U0001f600"},
+            [1, {"nested": [True, False, None]}],
+            -12.5e-3,
+            12345678901234567890,
+            "quote \" backslash \\ slash /",
+            0,
+        ]
+        self.assert_records(dumps(records), list(enumerate(records, start=1)))
+        self.assert_records(
+            dumps(records, ensure_ascii=False), list(enumerate(records, start=1))
+        )
+        self.assert_records(
+            dumps(records, indent=2), list(enumerate(records, start=1))
+        )
+
+    def test_ndjson(self):
+        body = '{"url": "a.com"}\n\n["caf\\u00e9"]\r\n"x"\nnot json\n7'
+        result = read_all(body, 65536)
+        self.assertEqual(result[:3], [(1, {"url": "a.com"}), (3, ["café"]), (4, "x")])
+        self.assertIsInstance(result[3][1], JSONDecodeError)
+        self.assertEqual(result[3][0], 5)
+        self.assertEqual(result[4], (6, 7))
+
+        for chunk_size in range(1, len(body) + 2):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(
+                    [
+                        (number, type(record))
+                        for number, record in read_all(body, chunk_size)
+                    ],
+                    [(number, type(record)) for number, record in result],
+                )
+
+    def test_truncated_values(self):
+        self.assert_error("[1, 1.5e", [1], "Expecting ',' delimiter")
+        self.assert_error("[1, -", [1], "Expecting value")
+        self.assert_error('[1, "caf\\u00', [1], "Invalid \\uXXXX escape")
+        self.assert_error('[1, "abc', [1], "Unterminated string")
+        self.assert_error('[1, {"a": ', [1], "Expecting value")
+        self.assert_error("[1, tru", [1], "Expecting value")
+        self.assert_error("[1, 2", [1, 2], "Unterminated array")
+        self.assert_error("[1, 2,", [1, 2], "Unterminated array")
+
+    def test_delimiters(self):
+        self.assert_error("[1 2]", [1], "Expecting ',' delimiter")
+        self.assert_error("[,1]", [], "Expecting value")
+        self.assert_error("[1,,2]", [1], "Expecting value")
+        self.assert_error("[1,]", [1], "Expecting value")
+        self.assert_error("[1] x", [1], "Extra data")
+        self.assert_error("[1]\n[2]", [1], "Extra data")
+        self.assert_error("[tru]", [], "Expecting value")
+        self.assert_error("[1.5e]", [], "Expecting ',' delimiter")
+
+    def test_record_too_large(self):
+        body = dumps([1, "a" * 100, 2])
+        self.assert_error(body, [1], "Record too large", max_record_size=50)
+        self.assert_records(body, [(1, 1), (2, "a" * 100), (3, 2)], max_record_size=200)
+        self.assert_error(
+            "[1, " + "9" * 100 + "]", [1], "Record too large", max_record_size=50
+        )
+
+        body = '1\n"' + "a" * 100 + '"\n2'
+        for chunk_size in range(1, len(body) + 2):
+            with self.subTest(chunk_size=chunk_size):
+                result = read_all(body, chunk_size, max_record_size=50)
+                self.assertEqual([result[0], result[2]], [(1, 1), (3, 2)])
+                self.assertEqual(result[1][0], 2)
+                self.assertEqual(result[1][1].msg, "Record too large")
+
+
+if __name__ == "__main__":
+    unittest.main()
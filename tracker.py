@@ -0,0 +1,236 @@
+"""
+Click Tracker Module
+
+This module decouples click tracking from the redirect path.
+Instead of enriching and storing every click while the client waits for its redirect,
+the redirect only enqueues a compact click event onto an in-process queue,
+and background worker threads drain the queue, enrich the events, and persist them.
+
+Classes:
+    - Tracker: A bounded queue of click events drained by background worker threads.
+
+Author: Yousef Saeed
+"""
+
+from queue import Queue, Full, Empty
+from threading import Thread, Lock
+import atexit
+
+from database import *
+
+
+# Sentinel put on the queue to tell a worker to exit.
+_STOP = object()
+
+
+class Tracker:
+    """
+    Tracker is a class for processing click events asynchronously in background workers.
+
+    Attributes:
+        handler (function): Called with a list of events inside an application context to persist them.
+        on_idle (function): Called inside an application context when the queue runs dry, to flush buffered writes.
+        idle_interval (float): How long a worker waits for an event before calling on_idle.
+        queue (Queue): The bounded queue holding pending events.
+        workers (int): The number of worker threads draining the queue.
+        overflow (str): What to do when the queue is full, either "drop" or "block".
+        block_timeout (float): How long "block" waits for room before dropping the event.
+        batch_size (int): The maximum number of events handed to the handler at once.
+
+    Methods:
+        - start()
+        - submit(event)
+        - flush()
+        - stop()
+        - stats()
+    """
+
+    def __init__(
+        self,
+        handler,
+        maxsize=10000,
+        workers=2,
+        overflow="drop",
+        block_timeout=0.05,
+        batch_size=100,
+        on_idle=None,
+        idle_interval=0.5,
+    ):
+        """
+        Initialize Tracker with a handler and queue settings.
+
+        Args:
+            handler (function): Called with a list of events to persist them.
+            maxsize (int, optional): The maximum number of pending events.
+            workers (int, optional): The number of worker threads.
+            overflow (str, optional): "drop" to discard new events when full, "block" to wait for room first.
+            block_timeout (float, optional): Seconds to wait for room when overflow is "block".
+            batch_size (int, optional): The maximum number of events handled at once.
+            on_idle (function, optional): Called when the queue runs dry, to flush buffered writes.
+            idle_interval (float, optional): Seconds a worker waits for an event before calling on_idle.
+        """
+
+        if overflow not in ("drop", "block"):
+            raise ValueError("overflow must be either 'drop' or 'block'.")
+
+        self.handler = handler
+        self.queue = Queue(maxsize)
+        self.workers = workers
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.batch_size = batch_size
+        self.on_idle = on_idle
+        self.idle_interval = idle_interval
+
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+
+        self._threads = []
+        self._lock = Lock()
+
+    def start(self):
+        """
+        Start the worker threads, if they are not already running.
+
+        Returns:
+            None
+        """
+
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = Thread(target=self._work, name=f"tracker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            atexit.register(self.stop)
+
+    def submit(self, event):
+        """
+        Enqueue a click event without waiting for it to be processed.
+
+        Args:
+            event: The click event to process.
+
+        Returns:
+            bool: True if the event was queued, False if it was dropped because the queue is full.
+        """
+
+        if not self._threads:
+            self.start()
+
+        try:
+            if self.overflow == "block":
+                self.queue.put(event, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(event)
+        except Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def flush(self):
+        """
+        Block until every queued event has been processed and stored.
+
+        Returns:
+            None
+        """
+
+        if self._threads:
+            self.queue.join()
+        self._idle()
+
+    def stop(self):
+        """
+        Process every queued event, then stop the worker threads.
+
+        This runs automatically when the interpreter exits, so clicks are not lost on shutdown.
+
+        Returns:
+            None
+        """
+
+        with self._lock:
+            threads, self._threads = self._threads, []
+
+        for _ in threads:
+            self.queue.put(_STOP)
+        for thread in threads:
+            thread.join()
+        self._idle()
+
+    def stats(self):
+        """
+        Get counters describing the tracker's activity.
+
+        Returns:
+            dict: The queue depth and the number of submitted, dropped, processed, and failed events.
+        """
+
+        return {
+            "queue_depth": self.queue.qsize(),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+    def _work(self):
+        """
+        Drain the queue in batches and pass each batch to the handler until told to stop.
+        """
+
+        running = True
+        while running:
+            try:
+                batch = [self.queue.get(timeout=self.idle_interval)]
+            except Empty:
+                self._idle()
+                continue
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            events = [event for event in batch if event is not _STOP]
+            running = len(events) == len(batch)
+            # Hand back any extra stop signals meant for the other workers.
+            for _ in range(len(batch) - len(events) - 1):
+                self.queue.put(_STOP)
+
+            if events:
+                with app.app_context():
+                    try:
+                        self.handler(events)
+                        with self._lock:
+                            self.processed += len(events)
+                    except Exception:
+                        db.session.rollback()
+                        with self._lock:
+                            self.failed += len(events)
+
+            for _ in batch:
+                self.queue.task_done()
+
+    def _idle(self):
+        """
+        Call on_idle inside an application context, if it is set.
+        """
+
+        if self.on_idle is None:
+            return
+
+        with app.app_context():
+            try:
+                self.on_idle()
+            except Exception:
+                db.session.rollback()
@@ -8,8 +8,7 @@ The short URLs can have optional expiration dates, and users can register and lo
 Author: Yousef Saeed
 """
 
-from flask import abort, request, session, render_template, redirect, url_for
-from sqlalchemy import desc
+from flask import abort, g, request, session, render_template, redirect, url_for
 from werkzeug.security import generate_password_hash, check_password_hash
 from jwt import encode
 from re import match
@@ -31,7 +30,9 @@ analyzer = Analyzer()
 
 def measure_response_time(f):
     """
-    Decorator to measure the response time of a view function.
+    Decorator to record when a view function starts handling a request, to measure its response time.
+
+    The start time is kept on the request context (g.start_time), so concurrent requests don't share it.
 
     Args:
         f (function): The view function to be measured.
@@ -42,11 +43,8 @@ def measure_response_time(f):
 
     @wraps(f)
     def wrapper(*args, **kwargs):
-        start_time = time()
-        response = f(*args, **kwargs)
-        total_elapsed_time = time() - start_time
-        analyzer.response_time = total_elapsed_time
-        return response
+        g.start_time = time()
+        return f(*args, **kwargs)
 
     return wrapper
 
@@ -77,14 +75,14 @@ def redirect_url(short_url):
         short_url (str): The short URL to resolve.
 
     Returns:
-        redirect: Redirects to the original URL if found, or a 404 error if not found.
+        redirect: Redirects to the original URL if found, or a 404 error if not found or expired.
     """
 
-    url = Url.query.filter_by(short_url=short_url).first()
+    url = Shortener().resolve(short_url)
     if url is not None:
-        analyzer.short_url = short_url
-        analyzer.user_agent = request.headers.get("User-Agent")
-        analyzer.track()
+        analyzer.track(
+            short_url, request.headers.get("User-Agent"), time() - g.start_time
+        )
         if not match("^(http|https)://", url.long_url):
             return redirect(f"https://{url.long_url}")
         else:
@@ -192,7 +190,7 @@ def unshorten():
 
     if request.method == "POST" and "url" in request.form:
         short_url = request.form["url"].split("/")[-1]
-        url = Url.query.filter_by(short_url=short_url).first()
+        url = Shortener().resolve(short_url)
         if url is not None:
             long_url = url.long_url
         else:
@@ -442,12 +440,8 @@ def dashboard():
             "%Y-%m-%dT%H:%M"
         )
 
-        urls = (
-            db.session.query(Url)
-            .where(Url.user_id == session["id"])
-            .order_by(desc(Url.creation_date))
-        )
-        if urls.count() <= 0:
+        total_urls = db.session.query(Url).where(Url.user_id == session["id"]).count()
+        if total_urls <= 0:
             return render_template("dashboard.html")
 
         if (
@@ -459,9 +453,7 @@ def dashboard():
                 url = Url.query.filter_by(
                     short_url=request.form["value"], user_id=session["id"]
                 ).first()
-                url.is_permanent = True
-                url.expiration_date = None
-                db.session.commit()
+                Shortener().update_exp_date(url.short_url, None)
                 msg = f'<span class="go-url" id="text-glow">{request.form["value"]}</span> is now permanent <span id="text-glow">∞ ✨</span>'
             elif "exp_date" in request.form and request.form["exp_date"] != "":
                 url = Url.query.filter_by(
@@ -486,9 +478,9 @@ def dashboard():
                 ):
                     msg = "The expiration date must be between 5 minutes from now and 50 years in the future."
                 else:
-                    url.is_permanent = False
-                    url.expiration_date = exp_date.strftime("%d-%m-%Y.%H:%M")
-                    db.session.commit()
+                    Shortener().update_exp_date(
+                        url.short_url, exp_date.strftime("%d-%m-%Y.%H:%M")
+                    )
                     msg = f'The expiration date for <span class="go-url" id="text-glow">{request.form["value"]}</span> has been set to <span id="text-glow">{exp_date.strftime("%d-%m-%Y.%H:%M")}</span>'
         elif (
             request.method == "POST"
@@ -498,19 +490,34 @@ def dashboard():
             url = Url.query.filter_by(
                 short_url=request.form["value"], user_id=session["id"]
             ).first()
-            analyzer.short_url = url.short_url
-            analyzer.delete()
-            db.session.delete(url)
-            db.session.commit()
+            Shortener().delete_short_url(url.short_url)
             msg = "Your URL has been deleted!"
-            if urls.count() <= 0:
+            total_urls -= 1
+            if total_urls <= 0:
                 return render_template("dashboard.html", msg=msg)
 
+        # Show one page of URLs, newest first, falling back to the first page if the cursor is stale or malformed.
+        cursor = request.args.get("cursor")
+        try:
+            urls, next_cursor = Shortener().list_urls(
+                session["id"], app.config["DASHBOARD_PAGE_SIZE"], cursor
+            )
+        except ValueError:
+            urls = []
+        if not urls:
+            cursor = None
+            urls, next_cursor = Shortener().list_urls(
+                session["id"], app.config["DASHBOARD_PAGE_SIZE"]
+            )
+
         return render_template(
             "dashboard.html",
             msg=msg,
             urls=urls,
-            analyzer=analyzer,
+            total_urls=total_urls,
+            cursor=cursor,
+            next_cursor=next_cursor,
+            url_stats=analyzer.analyze_many([url.short_url for url in urls]),
             countries=countries,
             datetime=datetime,
             precisedelta=precisedelta,
@@ -0,0 +1,286 @@
+"""
+Stat Writer Module
+
+This module batches click statistics before writing them to the database.
+Instead of committing every Stat row in its own transaction, rows are accumulated
+and written with a single bulk insert per batch, flushed when the batch is full or
+when the oldest pending row has waited longer than the flush interval.
+Each batch also updates the per-URL click counters in the same transaction.
+A batch that fails to write is put back in front of the pending rows and retried by the next flush;
+if the database stays down, the oldest rows beyond max_pending are dropped and counted.
+
+It can also import click logs from CSV or NDJSON files:
+
+    python writer.py clicks.csv [clicks.ndjson ...]
+
+Classes:
+    - StatWriter: A group-commit writer for Stat rows.
+
+Author: Yousef Saeed
+"""
+
+from sqlalchemy import insert
+from threading import Lock
+from time import perf_counter
+import csv
+import json
+import sys
+
+from database import *
+from converters import legacy_epoch, legacy_float
+from rollups import add_clicks
+
+
+class StatWriter:
+    """
+    StatWriter is a class for accumulating Stat rows and writing them in bulk.
+
+    Attributes:
+        batch_size (int): The number of pending rows that triggers a flush.
+        flush_interval (float): The number of seconds a row may wait before a flush is due.
+        max_pending (int): The maximum number of rows kept pending while flushes fail.
+
+    Methods:
+        - add(row)
+        - add_many(rows)
+        - is_due()
+        - flush()
+        - flush_if_due()
+        - stats()
+    """
+
+    def __init__(self, batch_size=500, flush_interval=1.0, max_pending=50000):
+        """
+        Initialize StatWriter with its flush triggers.
+
+        Args:
+            batch_size (int, optional): The number of pending rows that triggers a flush.
+            flush_interval (float, optional): The number of seconds a row may wait before a flush is due.
+            max_pending (int, optional): The maximum number of rows kept pending while flushes fail.
+        """
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+        self.failed_flushes = 0
+        self.failed_rows = 0
+        self.dropped_rows = 0
+
+        self._rows = []
+        self._oldest = None
+        self._lock = Lock()
+
+    def add(self, row):
+        """
+        Add a Stat row, flushing if the batch is full.
+
+        Args:
+            row (dict): The Stat column values.
+
+        Returns:
+            None
+        """
+
+        self.add_many([row])
+
+    def add_many(self, rows):
+        """
+        Add several Stat rows, flushing whenever the batch is full.
+
+        Args:
+            rows (iterable): The Stat column values, one dict per row.
+
+        Returns:
+            None
+        """
+
+        for row in rows:
+            with self._lock:
+                if not self._rows:
+                    self._oldest = perf_counter()
+                self._rows.append(row)
+                full = len(self._rows) >= self.batch_size
+            if full:
+                self.flush()
+
+    def is_due(self):
+        """
+        Check whether the oldest pending row has waited longer than the flush interval.
+
+        Returns:
+            bool: True if a flush is due, False otherwise.
+        """
+
+        return (
+            self._oldest is not None
+            and perf_counter() - self._oldest >= self.flush_interval
+        )
+
+    def flush(self):
+        """
+        Write every pending row with a single bulk insert, fold it into the click counters, and commit.
+
+        If the write fails, the rows are put back in front of the rows added since, so the next flush retries them,
+        and the error is raised.
+
+        Must be called inside an application context.
+
+        Returns:
+            int: The number of rows written.
+        """
+
+        with self._lock:
+            rows, self._rows = self._rows, []
+            oldest, self._oldest = self._oldest, None
+
+        if not rows:
+            return 0
+
+        start_time = perf_counter()
+        try:
+            db.session.execute(insert(Stat), rows)
+            add_clicks(rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self._put_back(rows, oldest)
+            raise
+        latency = perf_counter() - start_time
+
+        with self._lock:
+            self.flushes += 1
+            self.rows_written += len(rows)
+            self.last_batch_size = len(rows)
+            self.max_batch_size = max(self.max_batch_size, len(rows))
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.total_flush_latency += latency
+
+        return len(rows)
+
+    def flush_if_due(self):
+        """
+        Flush the pending rows if the flush interval has passed.
+
+        Returns:
+            int: The number of rows written.
+        """
+
+        return self.flush() if self.is_due() else 0
+
+    def stats(self):
+        """
+        Get metrics describing the writer's batches and flush latency.
+
+        Returns:
+            dict: Pending rows, flush counts, batch sizes, flush latencies in seconds, and the number of failed
+                flushes, rows put back by them, and rows dropped.
+        """
+
+        return {
+            "pending": len(self._rows),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "average_batch_size": (
+                self.rows_written / self.flushes if self.flushes else 0
+            ),
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+            "average_flush_latency": (
+                self.total_flush_latency / self.flushes if self.flushes else 0
+            ),
+            "failed_flushes": self.failed_flushes,
+            "failed_rows": self.failed_rows,
+            "dropped_rows": self.dropped_rows,
+        }
+
+    def _put_back(self, rows, oldest):
+        """
+        Put the rows of a failed flush back in front of the pending rows, dropping the oldest beyond max_pending.
+        """
+
+        with self._lock:
+            self.failed_flushes += 1
+            self.failed_rows += len(rows)
+            self._rows = rows + self._rows
+            self._oldest = oldest
+            overflow = len(self._rows) - self.max_pending
+            if overflow > 0:
+                del self._rows[:overflow]
+                self.dropped_rows += overflow
+
+
+def read_clicks(path):
+    """
+    Read a click log file, one Stat row per record.
+
+    Files ending in ".csv" must have a header naming Stat columns; anything else is read as NDJSON.
+    Entry times may be epochs or in the legacy "%d-%m-%Y.%H:%M:%S" format.
+
+    Args:
+        path (str): The path of the click log.
+
+    Yields:
+        dict: The Stat column values of each click.
+    """
+
+    columns = {column.name for column in Stat.__table__.columns} - {"id"}
+
+    with open(path, newline="") as file:
+        if path.endswith(".csv"):
+            records = csv.DictReader(file)
+        else:
+            records = (json.loads(line) for line in file if line.strip())
+
+        for record in records:
+            # Every row needs the same columns for the bulk insert.
+            row = {key: record.get(key) for key in columns}
+            row["entry_time"] = legacy_epoch(row["entry_time"])
+            for key in ("response_time", "latitude", "longitude", "distance"):
+                row[key] = legacy_float(row[key])
+            yield row
+
+
+def import_clicks(paths, writer=None):
+    """
+    Import click logs into the database through a StatWriter.
+
+    Args:
+        paths (list): The paths of the click logs.
+        writer (StatWriter, optional): The writer to use. If not provided, a large-batch writer is created.
+
+    Returns:
+        int: The number of clicks imported.
+    """
+
+    if writer is None:
+        writer = StatWriter(batch_size=5000)
+
+    written = writer.rows_written
+    for path in paths:
+        writer.add_many(read_clicks(path))
+    writer.flush()
+    return writer.rows_written - written
+
+
+writer = StatWriter(
+    batch_size=app.config["STATS_BATCH_SIZE"],
+    flush_interval=app.config["STATS_FLUSH_INTERVAL"],
+    max_pending=app.config["STATS_MAX_PENDING"],
+)
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        imported = import_clicks(sys.argv[1:])
+        print(f"Imported {imported} clicks.")